@@ -1,5 +1,9 @@
+import os
 import sys
 import time
+import math
+import torch
+import torch.nn.functional as F
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.io import wavfile
@@ -9,7 +13,7 @@ from mido import MidiFile, tempo2bpm
 from IPython.display import Audio
 
 from anticipation import ops
-from anticipation.sample import generate
+from anticipation.sample import generate, safe_logits, future_logits, instr_logits, nucleus
 from anticipation.tokenize import extract_instruments
 from anticipation.convert import events_to_midi, midi_to_events
 from anticipation.visuals import visualize
@@ -19,12 +23,20 @@ from anticipation.convert import MAX_DUR
 from chords import MIDI_Stream
 from melody import rule_based_melody
 from pprint import pprint
-from model_loader import load_model
+from model_loader import registry
 from audio_utils import normalize_wav
 from midi_utils import detect_bpm, save_midi_file
 from datetime import datetime
-def inpaint(midi_file_path, start_time, end_time, model, time_unit='bars'):
-    bpm = detect_bpm(midi_file_path)
+from event_cache import EventCache
+
+# converted events and tempo per file content, next to this module whatever the working directory
+event_cache = EventCache(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), "event_cache"))
+
+def inpaint(midi_file_path, start_time, end_time, model, time_unit='bars', session=None):
+    start = time.time()
+    events, bpm = event_cache.get(midi_file_path)
+    end = time.time()
+    print("MIDI converted in ", end-start, " seconds")
     if bpm is None:
         print("BPM not detected. Using default values.")
         bpm = 120
@@ -37,11 +49,6 @@ def inpaint(midi_file_path, start_time, end_time, model, time_unit='bars'):
         start_time = start_time * seconds_per_bar
         end_time = end_time * seconds_per_bar
 
-    start = time.time()
-    events = midi_to_events(midi_file_path)
-    end = time.time()
-    print("MIDI converted in ", end-start, " seconds")
-
     segment = events
     segment = ops.translate(segment, -ops.min_time(segment, seconds=False))
     # further work to be done here regarding the control flow and history...
@@ -49,19 +56,27 @@ def inpaint(midi_file_path, start_time, end_time, model, time_unit='bars'):
     anticipated = [CONTROL_OFFSET + tok for tok in ops.clip(segment, start_time + .01, end_time, clip_duration=False)]
 
     start = time.time()
-    inpainted = generate(model, start_time, end_time, inputs=history, controls=anticipated, top_p=.95)
+    if session is not None:
+        inpainted = session.generate(start_time, end_time, inputs=history, controls=anticipated)
+    else:
+        inpainted = generate(model, start_time, end_time, inputs=history, controls=anticipated, top_p=.95)
     end = time.time()
     print("Generated in ", end-start, " seconds")
     visualize(inpainted, 'output.png')
     combined = ops.combine(inpainted, anticipated)
     return inpainted, combined
 
-def chord_continuation(file_path, anti_dir):
-    global model
-    if not model:
-        print("Model not loaded. Please load a model first.")
+live_session = None # ContinuationSession reused by chord_continuation across takes
+
+def chord_continuation(file_path, anti_dir, model_size='small'):
+    global live_session
+    model = registry.get(model_size, wait=False)
+    if model is None:
+        print(f"Model '{model_size}' not loaded yet. Skipping continuation.")
         return
-    new_acc = continuation(file_path, model, 16, time_unit='bars', debug=True, viz=False)
+    if live_session is None or live_session.model is not model:
+        live_session = ContinuationSession(model)
+    new_acc = live_session.continuation(file_path, 16, time_unit='bars', debug=True, viz=False)
     save_midi_file(new_acc, anti_dir + "/continuation.mid")
 
 # def continue_and_send(midi_file_path, anti_dir):
@@ -88,9 +103,10 @@ def chord_continuation(file_path, anti_dir):
 #     pprint(melody_list)
 #     send_midi(client, melody_path, fire_immediately=True, track_index=1)
 
-def continuation(midi_file_path, model, length, newlength=None, time_unit='bars', debug=False, viz=False):
+def continuation(midi_file_path, model, length, newlength=None, time_unit='bars', debug=False, viz=False, session=None):
     # Outputs a continuation of the input MIDI file.
-    bpm = detect_bpm(midi_file_path)
+    # With a ContinuationSession, the model's key/value cache from the previous call is reused.
+    history, bpm = event_cache.get(midi_file_path)
     if bpm is None:
         [print("BPM not detected. Using default values.") if debug else None]
         bpm = 120
@@ -110,11 +126,201 @@ def continuation(midi_file_path, model, length, newlength=None, time_unit='bars'
     [print("length (in seconds: ", length) if debug else None]
     [print("newlength (in seconds): ", newlength) if debug else None]
 
-    history = midi_to_events(midi_file_path)
-    proposal = generate(model, start_time=length, end_time=length+newlength, inputs=history, top_p=.95)
+    if session is not None:
+        proposal = session.generate(start_time=length, end_time=length+newlength, inputs=history)
+    else:
+        proposal = generate(model, start_time=length, end_time=length+newlength, inputs=history, top_p=.95)
     continuation = ops.clip(proposal, length, length+newlength, clip_duration=False)
     continuation = ops.translate(continuation, -ops.min_time(continuation, seconds=False))
     if (viz):
         visualize(continuation, 'output.png')
 
-    return events_to_midi(continuation)
\ No newline at end of file
+    return events_to_midi(continuation)
+
+class ContinuationSession:
+    """
+    Live continuation/inpainting that keeps the model's past key/values between calls.
+
+    Every call still passes the whole played history, but only the tokens that differ
+    from what the model has already seen (usually just the newly played events) are run
+    through it: the cache is cropped back to the longest common prefix and extended from
+    there. Sampling follows anticipation.sample.generate, except that the context window
+    starts on a multiple of half a window and only jumps when the history outgrows it,
+    so the cache stays valid in between, within a call and across calls. The start
+    depends only on the history's length, never on earlier calls. The trade-off: the
+    model sees between half a window and the full context (1017 tokens) of history,
+    where anticipation.sample always sees the full context.
+
+    Example:
+        session = ContinuationSession(registry.get('small'))
+        midi = session.continuation("take.mid", 16)   # encodes the whole take
+        midi = session.continuation("take2.mid", 16)  # encodes only what was added
+    """
+    def __init__(self, model, top_p=.95, context=1017):
+        self.model = model
+        self.top_p = top_p
+        self.context = context # tokens of history the model sees, as in anticipation.sample
+        self.stats = {"encoded": 0, "forwards": 0}
+        self.reset()
+
+    def reset(self):
+        self.fed = []       # token ids covered by past
+        self.past = None    # past_key_values of fed
+        self.logits = None  # next-token logits after fed[-1]
+        self.window_start = 0
+
+    def continuation(self, midi_file_path, length, newlength=None, time_unit='bars', debug=False, viz=False):
+        return continuation(midi_file_path, self.model, length, newlength, time_unit, debug, viz, session=self)
+
+    def inpaint(self, midi_file_path, start_time, end_time, time_unit='bars'):
+        return inpaint(midi_file_path, start_time, end_time, self.model, time_unit, session=self)
+
+    def _crop(self, length):
+        if length == 0:
+            self.past = None
+        elif hasattr(self.past, "crop"): # transformers Cache object
+            self.past.crop(length)
+        else:
+            self.past = tuple((k[:, :, :length], v[:, :, :length]) for k, v in self.past)
+        self.fed = self.fed[:length]
+
+    def _next_logits(self, input_tokens):
+        """Logits after input_tokens, running only the part that isn't cached already."""
+        if self.logits is not None and self.fed == input_tokens:
+            return self.logits.clone()
+        return self._block_logits(input_tokens, 1)[0]
+
+    def _block_logits(self, input_tokens, positions):
+        """Logits after each of the last positions prefixes of input_tokens, in one forward pass."""
+        common = 0
+        for fed_tok, tok in zip(self.fed, input_tokens):
+            if fed_tok != tok:
+                break
+            common += 1
+        # positions already in the cache have no logits kept: rerun them
+        common = min(common, len(input_tokens) - positions)
+        if common < len(self.fed):
+            self._crop(common)
+        new_tokens = input_tokens[common:]
+        out = self.model(torch.tensor([new_tokens], device=self.model.device), past_key_values=self.past, use_cache=True)
+        self.past = out.past_key_values
+        self.fed = list(input_tokens)
+        self.logits = out.logits[0, -1]
+        self.stats["encoded"] += len(new_tokens)
+        self.stats["forwards"] += 1
+        return out.logits[0, -positions:].clone()
+
+    def _probs(self, logits, idx, i, current_time, full_tokens):
+        """
+        Sampling distribution for token i (0 time, 1 duration, 2 note) of an event at
+        sequence position idx, filtered like anticipation.sample.add_token.
+        """
+        logits = safe_logits(logits, idx)
+        if i == 0:
+            logits = future_logits(logits, current_time)
+        elif i == 2:
+            logits = instr_logits(logits, full_tokens)
+        logits = nucleus(logits, self.top_p)
+        return F.softmax(logits, dim=-1)
+
+    def _start_window(self, tokens):
+        """Window start for a history: the first multiple of half a window that leaves at most context tokens."""
+        step = self.context // 2 // 3 * 3 # whole events
+        excess = len(tokens) - self.context
+        self.window_start = 0 if excess <= 0 else -(-excess // step) * step
+
+    def _window(self, tokens):
+        """History the model sees, relativized in time, and its time offset."""
+        if len(tokens) - self.window_start > self.context:
+            self._start_window(tokens) # jump to the next half-window boundary
+        history = tokens[self.window_start:]
+        offset = ops.min_time(history, seconds=False)
+        history[::3] = [tok - offset for tok in history[::3]]
+        return history, offset
+
+    def add_token(self, z, tokens, current_time):
+        """Samples the next (time, duration, note) event like anticipation.sample.add_token."""
+        assert len(tokens) % 3 == 0
+        history, offset = self._window(tokens)
+        new_token = []
+        with torch.no_grad():
+            for i in range(3):
+                input_tokens = z + history + new_token
+                logits = self._next_logits(input_tokens)
+                probs = self._probs(logits, len(input_tokens) - 1, i, current_time - offset, tokens)
+                token = torch.multinomial(probs, 1)
+                new_token.append(int(token))
+
+        new_token[0] += offset # revert to full sequence timing
+        return new_token
+
+    def next_events(self, z, tokens, current_time, stop_time):
+        """
+        The next sampled events. Generation looks at each event's time before taking the
+        next one, so an event at or past stop_time (end of the generated span, or the
+        point where the next control gets inserted) must be the last one returned.
+        """
+        return [self.add_token(z, tokens, current_time)]
+
+    def generate(self, start_time, end_time, inputs=None, controls=None, delta=DELTA*TIME_RESOLUTION):
+        """anticipation.sample.generate with this session's cached add_token."""
+        if inputs is None:
+            inputs = []
+        if controls is None:
+            controls = []
+
+        start_time = int(TIME_RESOLUTION*start_time)
+        end_time = int(TIME_RESOLUTION*end_time)
+
+        # prompt is events up to start_time
+        prompt = ops.pad(ops.clip(inputs, 0, start_time, clip_duration=False, seconds=False), start_time)
+
+        # treat events beyond start_time as controls
+        future = ops.clip(inputs, start_time+1, ops.max_time(inputs, seconds=False), clip_duration=False, seconds=False)
+
+        # clip controls that preceed the sequence
+        controls = ops.clip(controls, DELTA, ops.max_time(controls, seconds=False), clip_duration=False, seconds=False)
+
+        z = [ANTICIPATE] if len(controls) > 0 or len(future) > 0 else [AUTOREGRESS]
+
+        # interleave the controls with the events
+        tokens, controls = ops.anticipate(prompt, ops.sort(controls + [CONTROL_OFFSET+token for token in future]))
+
+        current_time = ops.max_time(prompt, seconds=False)
+        self._start_window(tokens)
+        encoded, forwards = self.stats["encoded"], self.stats["forwards"]
+
+        if controls:
+            atime, adur, anote = controls[0:3]
+            anticipated_tokens = controls[3:]
+            anticipated_time = atime - ATIME_OFFSET
+        else:
+            # nothing to anticipate
+            anticipated_time = math.inf
+
+        while True:
+            while current_time >= anticipated_time - delta:
+                tokens.extend([atime, adur, anote])
+                if len(anticipated_tokens) > 0:
+                    atime, adur, anote = anticipated_tokens[0:3]
+                    anticipated_tokens = anticipated_tokens[3:]
+                    anticipated_time = atime - ATIME_OFFSET
+                else:
+                    # nothing more to anticipate
+                    anticipated_time = math.inf
+
+            finished = False
+            for new_token in self.next_events(z, tokens, max(start_time, current_time), min(end_time, anticipated_time - delta)):
+                new_time = new_token[0] - TIME_OFFSET
+                if new_time >= end_time:
+                    finished = True
+                    break
+
+                tokens.extend(new_token)
+                current_time = new_time
+            if finished:
+                break
+
+        print(f"Session: encoded {self.stats['encoded'] - encoded} tokens in {self.stats['forwards'] - forwards} forward passes")
+        events, _ = ops.split(tokens)
+        return ops.sort(ops.unpad(events) + future)
@@ -0,0 +1,85 @@
+# bench_anti_speculative.py
+"""
+Large-model anticipation continuation and inpainting with and without the small model
+as a speculative draft.
+
+For every MIDI file in test_midis/ the first --bars bars are continued by --new_bars
+bars, and the --inpaint bar span is regenerated around the rest of the file. Each task
+runs once with a plain ContinuationSession on the large model and once with a
+SpeculativeSession (small draft, large target). Fresh sessions are used per file and
+task so neither side reuses a cache. Reports wall-clock time, generated events, the
+share of drafted tokens the large model accepted and the speedup, per file and as
+means per task.
+
+Example:
+    python bench_anti_speculative.py --bars 4 --new_bars 2 --inpaint 2 4 --num_draft 4
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import time
+import torch
+from anti import ContinuationSession
+from model_loader import load_model
+from speculative import SpeculativeSession
+
+def time_continuation(session, midi_path, bars, new_bars, seed=0):
+    torch.manual_seed(seed)
+    t_start = time.perf_counter()
+    midi = session.continuation(midi_path, bars, new_bars, time_unit='bars')
+    seconds = time.perf_counter() - t_start
+    events = sum(1 for track in midi.tracks for msg in track if msg.type == 'note_on' and msg.velocity > 0)
+    return seconds, events
+
+def time_inpaint(session, midi_path, start_bar, end_bar, seed=0):
+    torch.manual_seed(seed)
+    t_start = time.perf_counter()
+    inpainted, _ = session.inpaint(midi_path, start_bar, end_bar, time_unit='bars')
+    seconds = time.perf_counter() - t_start
+    return seconds, len(inpainted) // 3
+
+def run_benchmark(midi_dir="test_midis", bars=4, new_bars=2, inpaint_bars=(2, 4), num_draft=4, target_size='large', draft_size='small'):
+    target = load_model(target_size)
+    draft = load_model(draft_size)
+    tasks = {
+        "continuation": lambda session, path: time_continuation(session, path, bars, new_bars),
+        "inpaint": lambda session, path: time_inpaint(session, path, *inpaint_bars),
+    }
+
+    rows = []
+    for midi_path in sorted(glob.glob(os.path.join(midi_dir, "*.mid"))):
+        for task, run in tasks.items():
+            plain_s, plain_events = run(ContinuationSession(target), midi_path)
+            spec = SpeculativeSession(target, draft, num_draft=num_draft)
+            spec_s, spec_events = run(spec, midi_path)
+            rows.append({"file": os.path.basename(midi_path), "task": task, "plain_s": plain_s, "plain_events": plain_events,
+                         "spec_s": spec_s, "spec_events": spec_events, "acceptance": spec.acceptance_rate()})
+
+    print(f"\n{'file':<24} {'task':<12} {target_size + ' s':>8} {'events':>6} {'spec s':>7} {'events':>6} {'accept':>7} {'speedup':>8}")
+    for r in rows:
+        print(f"{r['file']:<24} {r['task']:<12} {r['plain_s']:>8.2f} {r['plain_events']:>6} {r['spec_s']:>7.2f} {r['spec_events']:>6} "
+              f"{r['acceptance']:>7.2f} {r['plain_s'] / r['spec_s']:>7.2f}x")
+    for task in tasks:
+        task_rows = [r for r in rows if r["task"] == task]
+        if not task_rows:
+            continue
+        plain = statistics.mean(r["plain_s"] for r in task_rows)
+        spec = statistics.mean(r["spec_s"] for r in task_rows)
+        print(f"{'mean':<24} {task:<12} {plain:>8.2f} {'':>6} {spec:>7.2f} {'':>6} "
+              f"{statistics.mean(r['acceptance'] for r in task_rows):>7.2f} {plain / spec:>7.2f}x")
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Anticipation continuation and inpainting: large model alone vs small-model speculative drafts")
+    parser.add_argument("--midi_dir", default="test_midis", help="Directory of input MIDI files")
+    parser.add_argument("--bars", type=int, default=4, help="Bars of each file used as history for continuation")
+    parser.add_argument("--new_bars", type=int, default=2, help="Bars generated by continuation")
+    parser.add_argument("--inpaint", type=int, nargs=2, default=[2, 4], metavar=("START", "END"),
+                        help="Bar span regenerated by inpainting")
+    parser.add_argument("--num_draft", type=int, default=4, help="Tokens drafted per large-model pass")
+    parser.add_argument("--target", default="large", choices=["small", "medium", "large"])
+    parser.add_argument("--draft", default="small", choices=["small", "medium", "large"])
+    args = parser.parse_args()
+    run_benchmark(args.midi_dir, args.bars, args.new_bars, tuple(args.inpaint), args.num_draft, args.target, args.draft)
@@ -0,0 +1,68 @@
+# bench_cpt_decode.py
+"""
+Tokens/sec of the CPT melody generator: the original loop (one model.generate call
+over the whole prefix per token) vs the key/value cached incremental loop.
+
+Both loops run on the same chord tokens from every MIDI file in test_midis/ with the
+same torch seed. Only generated melody tokens count towards tokens/sec; the chord
+tokens fed between them are part of the cost.
+
+Example:
+    python bench_cpt_decode.py --chords 32 --repeats 2
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import time
+import torch
+import melody_generator
+from melody_generator import setup_model, seed_chords_tokens, _generate_tokens_full, _generate_tokens_cached
+
+LOOPS = {"full": _generate_tokens_full, "kv_cache": _generate_tokens_cached}
+
+def time_loop(loop, chords_tokens, num_chords, repeats, temperature=0.75, max_melody_notes_per_chord=12):
+    """Returns (melody tokens per second, seconds) over repeats runs."""
+    chord_token_count = sum(len(group) for group in chords_tokens[:num_chords])
+    generated = 0
+    seconds = 0.
+    for r in range(repeats):
+        torch.manual_seed(r)
+        t_start = time.perf_counter()
+        output_tokens = loop(chords_tokens, temperature, max_melody_notes_per_chord, num_chords)
+        seconds += time.perf_counter() - t_start
+        generated += len(output_tokens) - chord_token_count
+    return generated / seconds if seconds else 0., seconds
+
+def run_benchmark(midi_dir="test_midis", num_chords=32, repeats=2):
+    setup_model()
+    if not getattr(melody_generator.model.net, 'can_cache_kv', False):
+        print("This model build can't cache keys/values; only the full loop would run.")
+        return []
+
+    rows = []
+    for midi_path in sorted(glob.glob(os.path.join(midi_dir, "*.mid"))):
+        chords_tokens = seed_chords_tokens(midi_path)
+        chords = min(len(chords_tokens), num_chords)
+        row = {"file": os.path.basename(midi_path), "chords": chords}
+        for name, loop in LOOPS.items():
+            row[name], _ = time_loop(loop, chords_tokens, chords, repeats)
+        rows.append(row)
+
+    print(f"\n{'file':<24} {'chords':>6} {'full tok/s':>11} {'kv tok/s':>9} {'speedup':>8}")
+    for r in rows:
+        print(f"{r['file']:<24} {r['chords']:>6} {r['full']:>11.1f} {r['kv_cache']:>9.1f} {r['kv_cache'] / r['full']:>7.2f}x")
+    if rows:
+        full = statistics.mean(r["full"] for r in rows)
+        cached = statistics.mean(r["kv_cache"] for r in rows)
+        print(f"{'mean':<24} {'':>6} {full:>11.1f} {cached:>9.1f} {cached / full:>7.2f}x")
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPT melody generation tokens/sec: full-prefix loop vs KV-cached loop")
+    parser.add_argument("--midi_dir", default="test_midis", help="Directory of seed MIDI files")
+    parser.add_argument("--chords", type=int, default=32, help="Chords generated per file")
+    parser.add_argument("--repeats", type=int, default=2, help="Runs per file and loop")
+    args = parser.parse_args()
+    run_benchmark(args.midi_dir, args.chords, args.repeats)
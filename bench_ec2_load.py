@@ -0,0 +1,79 @@
+# bench_ec2_load.py
+"""
+Cold-start load time and per-window latency of EC2VAE from the .pt parameter file
+vs the traced artifact written by ec2vae_artifact.py.
+
+Load times are measured in fresh processes (python ec2vae_artifact.py time_load) so
+nothing is already imported or cached. Per-window latency decodes the same input
+with an EC2Generator of each form. The artifact is exported first if it is missing.
+
+Example:
+    python bench_ec2_load.py --runs 5 --midi test_midis/messtest.mid
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from ec2vae_artifact import export_artifact
+from ec2_gen import EC2Generator
+
+MODEL_PATH = './icm-deep-music-generation/ec2vae/model_param/ec2vae-v1.pt'
+PICKLE_PATH = "./GP_Melody_Chords/ec2_with_UJB.pkl"
+
+def cold_load_times(form, runs, model_path, artifact_dir):
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "ec2vae_artifact.py", "time_load", "--form", form,
+                              "--model_path", model_path, "--out", artifact_dir],
+                             capture_output=True, text=True, check=True).stdout
+        times.append(json.loads(out.strip().splitlines()[-1])["load_seconds"])
+    return times
+
+def window_times(generator, midi_path, song_key, repeats, window_size=32):
+    _, _, _, song_data = generator.song_select(song_key)
+    random.seed(0)
+    prepared = generator.prepare_song_input(song_key, song_data, window_size, test_midi=midi_path, bpm=100)
+    windows = list(generator.iterate_windows(*prepared[1:5], window_size))
+    times = []
+    for _ in range(repeats):
+        for window in windows:
+            t_start = time.perf_counter()
+            generator.decode_window(*window)
+            times.append(time.perf_counter() - t_start)
+    return times
+
+def run_benchmark(midi_path, runs=5, repeats=3, model_path=MODEL_PATH, artifact_dir="./ec2vae_traced",
+                  song_key='Grateful Dead - Uncle Johns Band.mid'):
+    if not os.path.isdir(artifact_dir):
+        export_artifact(model_path, artifact_dir)
+
+    results = {}
+    for form in ("pt", "artifact"):
+        loads = cold_load_times(form, runs, model_path, artifact_dir)
+        generator = EC2Generator(model_path=model_path, pickle_path=PICKLE_PATH,
+                                 artifact_path=artifact_dir if form == "artifact" else None)
+        windows = window_times(generator, midi_path, song_key, repeats)
+        results[form] = {"load": loads, "window": windows}
+
+    print(f"\n{'form':<10} {'load mean ms':>13} {'load min ms':>12} {'window mean ms':>15} {'window p95 ms':>14}")
+    for form, r in results.items():
+        window_ms = sorted(t * 1000 for t in r["window"])
+        p95 = window_ms[min(len(window_ms) - 1, int(0.95 * len(window_ms)))]
+        print(f"{form:<10} {statistics.mean(r['load']) * 1000:>13.1f} {min(r['load']) * 1000:>12.1f} "
+              f"{statistics.mean(window_ms):>15.2f} {p95:>14.2f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EC2VAE .pt vs traced artifact: cold-start load and per-window latency")
+    parser.add_argument("--midi", default="test_midis/messtest.mid", help="Input MIDI file for the window latency")
+    parser.add_argument("--runs", type=int, default=5, help="Cold-start loads per form")
+    parser.add_argument("--repeats", type=int, default=3, help="Times the input is decoded per form")
+    parser.add_argument("--model_path", default=MODEL_PATH)
+    parser.add_argument("--artifact", default="./ec2vae_traced", help="Artifact directory (exported if missing)")
+    args = parser.parse_args()
+    run_benchmark(args.midi, args.runs, args.repeats, args.model_path, args.artifact)
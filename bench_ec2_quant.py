@@ -0,0 +1,110 @@
+# bench_ec2_quant.py
+"""
+Float32 vs optimized (int8 dynamic quantization + inference mode) EC2VAE on CPU,
+swept over intra-op thread counts.
+
+For every MIDI file in test_midis/ and every thread count, the same rule-based input is
+decoded window by window with both models. Reports the mean latency per window, the
+fastest thread count per model (what EC2Generator(num_threads="auto") picks at startup)
+and how far the optimized output drifts from float32:
+    tick agreement: share of sixteenth steps with the same value (pitch/sustain/rest)
+    note agreement: share of note onsets (in either output) with the same pitch at the same step
+
+Example:
+    python bench_ec2_quant.py --threads 1 2 4 8 --repeats 3
+"""
+
+import argparse
+import glob
+import os
+import random
+import statistics
+import time
+import numpy as np
+import torch
+from ec2_gen import EC2Generator, thread_candidates
+
+MODEL_PATH = './icm-deep-music-generation/ec2vae/model_param/ec2vae-v1.pt'
+PICKLE_PATH = "./GP_Melody_Chords/ec2_with_UJB.pkl"
+
+def note_agreement(a, b):
+    onsets_a = a < 128
+    onsets_b = b < 128
+    union = onsets_a | onsets_b
+    if not union.any():
+        return 1.0
+    return float((onsets_a & onsets_b & (a == b)).sum() / union.sum())
+
+def time_windows(generator, windows, repeats):
+    """Returns (prediction, seconds per window) for decoding every window repeats times."""
+    times = []
+    prediction = None
+    for _ in range(repeats):
+        outputs = []
+        for window in windows:
+            t_start = time.perf_counter()
+            outputs.append(generator.decode_window(*window))
+            times.append(time.perf_counter() - t_start)
+        prediction = np.concatenate(outputs)
+    return prediction, times
+
+def run_benchmark(midi_dir="test_midis", song_key='Grateful Dead - Uncle Johns Band.mid', threads=None, repeats=3, window_size=32):
+    """threads: intra-op thread counts to sweep (default: thread_candidates())."""
+    if threads is None:
+        threads = thread_candidates()
+    reference = EC2Generator(model_path=MODEL_PATH, pickle_path=PICKLE_PATH)
+    optimized = EC2Generator(model_path=MODEL_PATH, pickle_path=PICKLE_PATH, optimize=True)
+    song_key, _, _, song_data = reference.song_select(song_key)
+
+    inputs = []
+    for midi_path in sorted(glob.glob(os.path.join(midi_dir, "*.mid"))):
+        random.seed(0) # same rule-based melody for both models
+        prepared = reference.prepare_song_input(song_key, song_data, window_size, test_midi=midi_path, bpm=100, write_midi=False)
+        inputs.append((os.path.basename(midi_path), list(reference.iterate_windows(*prepared[1:5], window_size))))
+
+    rows = []
+    for num_threads in threads:
+        torch.set_num_threads(num_threads)
+        print(f"torch threads: {torch.get_num_threads()}")
+        for name, windows in inputs:
+            fp32_prediction, fp32_times = time_windows(reference, windows, repeats)
+            int8_prediction, int8_times = time_windows(optimized, windows, repeats)
+            rows.append({
+                "file": name,
+                "threads": num_threads,
+                "windows": len(windows),
+                "fp32_ms": statistics.mean(fp32_times) * 1000,
+                "int8_ms": statistics.mean(int8_times) * 1000,
+                "tick_agreement": float((fp32_prediction == int8_prediction).mean()),
+                "note_agreement": note_agreement(fp32_prediction, int8_prediction),
+            })
+
+    print(f"\n{'file':<24} {'threads':>7} {'windows':>7} {'fp32 ms':>8} {'int8 ms':>8} {'speedup':>8} {'ticks':>6} {'notes':>6}")
+    for r in rows:
+        print(f"{r['file']:<24} {r['threads']:>7} {r['windows']:>7} {r['fp32_ms']:>8.2f} {r['int8_ms']:>8.2f} "
+              f"{r['fp32_ms'] / r['int8_ms']:>7.2f}x {r['tick_agreement']:>6.2f} {r['note_agreement']:>6.2f}")
+    if not rows:
+        return rows
+    print(f"\n{'threads':<24} {'':>7} {'':>7} {'fp32 ms':>8} {'int8 ms':>8} {'speedup':>8} {'ticks':>6} {'notes':>6}")
+    means = {}
+    for num_threads in threads:
+        sweep = [r for r in rows if r["threads"] == num_threads]
+        fp32 = statistics.mean(r["fp32_ms"] for r in sweep)
+        int8 = statistics.mean(r["int8_ms"] for r in sweep)
+        means[num_threads] = (fp32, int8)
+        print(f"{num_threads:<24} {'':>7} {'':>7} {fp32:>8.2f} {int8:>8.2f} {fp32 / int8:>7.2f}x "
+              f"{statistics.mean(r['tick_agreement'] for r in sweep):>6.2f} {statistics.mean(r['note_agreement'] for r in sweep):>6.2f}")
+    best_fp32 = min(means, key=lambda n: means[n][0])
+    best_int8 = min(means, key=lambda n: means[n][1])
+    print(f"\nFastest: fp32 with {best_fp32} threads ({means[best_fp32][0]:.2f} ms per window), "
+          f"int8 with {best_int8} threads ({means[best_int8][1]:.2f} ms per window)")
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Float32 vs int8 EC2VAE latency and output agreement")
+    parser.add_argument("--midi_dir", default="test_midis", help="Directory of input MIDI files")
+    parser.add_argument("--threads", type=int, nargs="+", default=None,
+                        help="torch intra-op thread counts to sweep (default: powers of two up to the core count)")
+    parser.add_argument("--repeats", type=int, default=3, help="Times each file is decoded per model")
+    args = parser.parse_args()
+    run_benchmark(args.midi_dir, threads=args.threads, repeats=args.repeats)
@@ -0,0 +1,122 @@
+# bench_latency.py
+"""
+End-to-end latency benchmark for the NeuralNote -> GuitarBot path.
+
+Runs main.midi_to_GB_UDP behind the real directory watcher, points its OSC client
+at a local GuitarBotReceiver and drops a MIDI file into the watched directory.
+It then reports the file-created -> first /Pluck arrival latency (time to first
+note), the time until the last packet was sent and a per-stage breakdown over
+repeated runs. With --progressive, "generate" ends when the last window is done,
+so it overlaps the beat wait and send stages.
+
+Example:
+    python bench_latency.py --midi test_midis/messtest.mid --runs 10
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from osc_transport import get_transport
+import main
+from ec2_gen import EC2Generator
+from gb_receiver import GuitarBotReceiver
+from watcher import watch_directory
+
+# (name, start stamp, end stamp) pairs over main.last_take_times plus the file drop and arrival
+STAGES = [
+    ("detect", "created", "start"),
+    ("parse", "start", "parsed"),
+    ("generate", "parsed", "generated"),
+    ("beat wait", "generated", "send_start"),
+    ("send", "send_start", "sent"),
+    ("delivery", "send_start", "arrival"),
+    ("first note", "created", "arrival"),
+    ("total", "created", "sent"),
+]
+
+def drop_file(src, watch_dir, name):
+    """
+    Places src in watch_dir under name in one step, so the watcher never sees a
+    half-written file. Returns the time.time() stamp of the drop.
+    """
+    staging = os.path.join(watch_dir, "." + name + ".tmp")
+    shutil.copyfile(src, staging)
+    dest = os.path.join(watch_dir, name)
+    created = time.time()
+    try:
+        os.link(staging, dest)
+    except OSError:
+        created = time.time()
+        shutil.copyfile(staging, dest)
+    os.remove(staging)
+    return created
+
+def run_benchmark(midi_path, runs=5, port=12001, bundle=False, progressive=False, timeout=60.0):
+    watch_dir = tempfile.mkdtemp(prefix="gb_bench_")
+    receiver = GuitarBotReceiver("127.0.0.1", port, verbose=False).start()
+
+    # Stand in for the globals main.py sets up in __main__
+    main.client = get_transport().client("127.0.0.1", port)
+    main.ableton_client = get_transport().client("127.0.0.1", port + 1)
+    main.playing_position = 0.0 # no Live: pretend the transport sits on a downbeat
+    main.ec2_generator = EC2Generator(
+        model_path='./icm-deep-music-generation/ec2vae/model_param/ec2vae-v1.pt',
+        pickle_path="./GP_Melody_Chords/ec2_with_UJB.pkl"
+    )
+
+    callback = lambda path: main.midi_to_GB_UDP(path, bundle=bundle, progressive=progressive)
+    watcher_thread = threading.Thread(target=watch_directory, args=(watch_dir, callback), daemon=True)
+    watcher_thread.start()
+    time.sleep(0.5) # let the observer start
+
+    results = []
+    failed = 0
+    try:
+        for run in range(runs):
+            created = drop_file(midi_path, watch_dir, f"bench_{run}.mid")
+            entry = receiver.wait_for("/Pluck", after=created, timeout=timeout)
+            if entry is None:
+                print(f"Run {run + 1}: no /Pluck received within {timeout}s")
+                failed += 1
+                main.last_take_times = {}
+                continue
+            # Wait for the sender to finish stamping this take
+            stamp_deadline = time.time() + timeout
+            while "sent" not in main.last_take_times and time.time() < stamp_deadline:
+                time.sleep(0.001)
+            if "sent" not in main.last_take_times:
+                print(f"Run {run + 1}: failed, the take was not sent within {timeout}s")
+                failed += 1
+                main.last_take_times = {}
+                continue
+            stamps = dict(main.last_take_times, created=created, arrival=entry["arrival"])
+            result = {name: stamps[end] - stamps[start] for name, start, end in STAGES}
+            results.append(result)
+            print(f"Run {run + 1}: first note {result['first note'] * 1000:.1f} ms, total {result['total'] * 1000:.1f} ms")
+            main.last_take_times = {}
+    finally:
+        receiver.stop()
+        shutil.rmtree(watch_dir, ignore_errors=True)
+
+    if failed:
+        print(f"\n{failed}/{runs} runs failed")
+    if results:
+        print(f"\n{'stage':<10} {'mean ms':>9} {'median ms':>10} {'max ms':>9}")
+        for name, _, _ in STAGES:
+            values = [r[name] * 1000 for r in results]
+            print(f"{name:<10} {statistics.mean(values):>9.1f} {statistics.median(values):>10.1f} {max(values):>9.1f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="File-created -> GuitarBot packet latency benchmark")
+    parser.add_argument("--midi", default="test_midis/messtest.mid", help="MIDI file to drop into the watched directory")
+    parser.add_argument("--runs", type=int, default=5, help="Number of repeated runs")
+    parser.add_argument("--port", type=int, default=12001, help="Port for the local GuitarBot receiver")
+    parser.add_argument("--bundle", action="store_true", help="Send as a time-tagged OSC bundle")
+    parser.add_argument("--progressive", action="store_true", help="Send /Pluck chunks window by window as they are decoded")
+    args = parser.parse_args()
+    run_benchmark(args.midi, runs=args.runs, port=args.port, bundle=args.bundle, progressive=args.progressive)
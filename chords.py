@@ -3,6 +3,7 @@ import time
 import pretty_midi
 from pprint import pprint
 import numpy as np
+from osc_utils import split_rows_by_size, chunk_relative_times, osc_string_size, MTU_MAX_PACKET_SIZE
 class MIDI_Stream:
     def __init__(self, midi_file, bpm=None, timesig=[4, 4]):
         self.midi_file = midi_file
@@ -12,6 +13,22 @@ class MIDI_Stream:
         self.timesig = timesig
         self.notes = self.get_notes()
 
+    @classmethod
+    def from_notes(cls, notes, duration, bpm, timesig=[4, 4]):
+        """
+        Builds a MIDI_Stream over an in-memory list of {"pitch", "onset", "offset"} note
+        dictionaries (seconds) instead of a MIDI file, e.g. for a window of a take that
+        is still being transcribed.
+        """
+        ms = cls.__new__(cls)
+        ms.midi_file = None
+        ms.midi_stream = None
+        ms.duration = duration
+        ms.bpm = bpm
+        ms.timesig = timesig
+        ms.notes = sorted(notes, key=lambda n: n["onset"])
+        return ms
+
     def get_tempo(self):
         tempo_changes = self.midi_stream.get_tempo_changes()
         if len(tempo_changes[0]) > 0:
@@ -142,41 +159,22 @@ class MIDI_Stream:
             last_chord = chord
         return chord_list, strum_list, pluck_list, full_chords
     
-def split_chord_message(chord_message):
-    """Split pluck message into chunks."""
-    # Convert the chord_message to an array with explicit dtype
-    chord_message_array = []
-    for item in chord_message:
-        # Convert the second element (time value) to float
-        chord_message_array.append([str(item[0]), float(item[1])])
-    
-    # Create array with explicit dtypes
-    chord_message = np.array([(str(x[0]), float(x[1])) for x in chord_message_array],
-                            dtype=[('chord', 'U50'), ('time', float)])
-    
-    if len(chord_message) < 40:
-        return chord_message
-    
-    chunked_messages = []
-    chunk_size = 39
-    last_ot = 0.0
-    
-    for i in range(0, len(chord_message), chunk_size):
-        chunk = chord_message[i:i+chunk_size].copy()  # Make a copy to avoid modifying original
-        # print(f"Chunk {i//chunk_size + 1} starts at time: {chunk[0]['time']}")
-        
-        # Access structured array with field names
-        ot_offset = float(chunk[0]['time']) - last_ot
-        last_ot = float(chunk[-1]['time'])
-        
-        # Update times using field access
-        for j in range(len(chunk)):
-            chunk[j]['time'] = float(chunk[j]['time']) - float(chunk[0]['time']) + ot_offset
-        
-        # Convert back to list format for the return value
-        result = []
-        for row in chunk:
-            result.append([row['chord'], round(float(row['time']), 5)])
-            
-        chunked_messages.append(result)
-    return chunked_messages
\ No newline at end of file
+def split_chord_message(chord_message, max_packet_size=MTU_MAX_PACKET_SIZE):
+    """
+    Split chord message into chunks that each fit in one /Chords datagram.
+    Returns a flat list of [chord, time] rows if everything fits in one message.
+    """
+    names = [str(item[0]) for item in chord_message]
+    times = np.array([float(item[1]) for item in chord_message], dtype=float)
+
+    # Every row is sent as a [string, float] array: 4 type tags, padded string + 4 bytes.
+    row_payload = np.array([osc_string_size(name) + 4 for name in names], dtype=int)
+    starts = split_rows_by_size("/Chords", np.full(len(names), 4), row_payload, max_packet_size)
+    if len(starts) == 1:
+        return [[name, t] for name, t in zip(names, np.round(times, 5).tolist())]
+
+    # Normalize the times of each chunk to start from the last time of the previous chunk
+    times = np.round(chunk_relative_times(times, starts), 5).tolist()
+    rows = [[name, t] for name, t in zip(names, times)]
+    ends = np.append(starts[1:], len(rows))
+    return [rows[start:end] for start, end in zip(starts, ends)]
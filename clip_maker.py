@@ -3,51 +3,129 @@ import time
 import threading
 import mido
 from pythonosc.dispatcher import Dispatcher
-from pythonosc import osc_server, udp_client
+from osc_transport import get_transport
 
 response_port = 11001  # Port to receive OSC responses
 received_data = {"bpm": 120, "time_signature": (4, 4)}  # Dictionary to store received values
 DEFAULT_BPM = 120  # Default BPM value
+
+class LiveTempoState:
+    def __init__(self, default_bpm=DEFAULT_BPM, default_time_signature=(4, 4)):
+        """
+        Tempo and time signature of the Live set, kept current by AbletonOSC listeners.
+
+        Readers never wait: until Live answers (or if it is not running at all) the
+        defaults are returned.
+
+        Args:
+            default_bpm: BPM to use while Live has not reported a tempo.
+            default_time_signature: (numerator, denominator) to use until Live reports one.
+        """
+        self.default_bpm = default_bpm
+        self.default_time_signature = tuple(default_time_signature)
+        self.bpm = default_bpm
+        self.time_signature = tuple(default_time_signature)
+        self.live = False # True once Live has sent at least one update
+        self.last_update = None
+        self.updated = threading.Event()
+        self._lock = threading.Lock()
+
+    def attach(self, dispatcher):
+        """Maps the tempo and time signature replies/updates on a dispatcher to this state."""
+        dispatcher.map("/live/song/get/tempo", self.tempo_handler)
+        dispatcher.map("/live/song/get/signature_numerator", self.signature_handler)
+        dispatcher.map("/live/song/get/signature_denominator", self.signature_handler)
+
+    def start_listening(self, client):
+        """
+        Subscribes to tempo and time signature changes. AbletonOSC answers each
+        start_listen with the current value and then again on every change.
+        """
+        for prop in ("tempo", "signature_numerator", "signature_denominator"):
+            client.send_message(f"/live/song/start_listen/{prop}", [])
+
+    def stop_listening(self, client):
+        for prop in ("tempo", "signature_numerator", "signature_denominator"):
+            client.send_message(f"/live/song/stop_listen/{prop}", [])
+
+    def tempo_handler(self, address, *args):
+        with self._lock:
+            changed = args[0] != self.bpm
+            self.bpm = args[0]
+            self._mark_updated()
+        received_data["bpm"] = args[0]
+        if changed:
+            print(f"Received BPM: {args[0]}")
+
+    def signature_handler(self, address, *args):
+        with self._lock:
+            numerator, denominator = self.time_signature
+            if "numerator" in address:
+                numerator = args[0]
+            elif "denominator" in address:
+                denominator = args[0]
+            changed = (numerator, denominator) != self.time_signature
+            self.time_signature = (numerator, denominator)
+            self._mark_updated()
+        received_data["time_signature"] = self.time_signature
+        if changed:
+            print(f"Received Time Signature: {numerator}/{denominator}")
+
+    def _mark_updated(self):
+        self.live = True
+        self.last_update = time.time()
+        self.updated.set()
+
+    def snapshot(self):
+        """Returns (bpm, time_signature) as one consistent pair."""
+        with self._lock:
+            return self.bpm, self.time_signature
+
+    @property
+    def seconds_per_beat(self):
+        return 60 / self.bpm
+
+    def reset(self):
+        """Goes back to the defaults, e.g. after losing contact with Live."""
+        with self._lock:
+            self.bpm = self.default_bpm
+            self.time_signature = self.default_time_signature
+            self.live = False
+            self.updated.clear()
+
+# Shared state for this process
+live_state = LiveTempoState()
+
 # Callback functions for OSC responses
 def bpm_callback(address, *args):
-    received_data["bpm"] = args[0]
-    print(f"Received BPM: {args[0]}")
+    live_state.tempo_handler(address, *args)
 
 def time_signature_callback(address, *args):
-    if "numerator" in address:
-        received_data["time_signature"] = (args[0], received_data["time_signature"][1])
-        print(f"Received Time Signature Numerator: {args[0]}")
-    elif "denominator" in address:
-        received_data["time_signature"] = (received_data["time_signature"][0], args[0])
-        print(f"Received Time Signature Denominator: {args[0]}")
+    live_state.signature_handler(address, *args)
 
 # Setup the dispatcher
 dispatcher = Dispatcher()
-dispatcher.map("/live/song/get/tempo", bpm_callback)  # Map the tempo query response
-dispatcher.map("/live/song/get/signature_numerator", time_signature_callback)  # Map the time signature query response
-dispatcher.map("/live/song/get/signature_denominator", time_signature_callback)  # Map the time signature query response
-# Start the OSC server in a separate thread
+live_state.attach(dispatcher)
+# Start the OSC server on the shared asyncio transport
 def start_server(ip, port):
-    server = osc_server.ThreadingOSCUDPServer((ip, port), dispatcher)
-    print(f"OSC Server running on {server.server_address}")
-    server.serve_forever()
-
-def query_ableton(client):
-    # Query Ableton for BPM and time signature
-    client.send_message("/live/song/get/tempo", [])  # Request BPM
-    client.send_message("/live/song/get/signature_numerator", [])  # Request time signature
-    client.send_message("/live/song/get/signature_denominator", [])  # Request time signature denominator
-    # Wait for responses (you might need to adjust the sleep time)
-    time.sleep(1)
-
-    bpm = received_data.get("bpm")
-    time_signature = received_data.get("time_signature")
-
-    if bpm is None or time_signature is None:
-        print("Failed to receive BPM or Time Signature from Ableton")
-        bpm = DEFAULT_BPM
-        time_signature = (4, 4)
-
+    return get_transport().serve(ip, port, dispatcher)
+
+def query_ableton(client, state=None, timeout=1.0):
+    """
+    Returns (bpm, time_signature) from Live. If the state is already being kept up to
+    date by listeners this returns immediately; otherwise it queries Live and waits at
+    most timeout seconds for the first answer before falling back to the defaults.
+    """
+    state = state or live_state
+    if not state.live:
+        # Query Ableton for BPM and time signature
+        client.send_message("/live/song/get/tempo", [])  # Request BPM
+        client.send_message("/live/song/get/signature_numerator", [])  # Request time signature
+        client.send_message("/live/song/get/signature_denominator", [])  # Request time signature denominator
+        if not state.updated.wait(timeout):
+            print("Failed to receive BPM or Time Signature from Ableton")
+
+    bpm, time_signature = state.snapshot()
     print(f"Final BPM: {bpm}, Time Signature: {time_signature[0]}/{time_signature[1]}")
     return bpm, time_signature
 
@@ -85,15 +163,11 @@ if __name__ == "__main__":
                         help="The port to listen on")
     args = parser.parse_args()
 
-    # Start the server in a separate thread
-    server_thread = threading.Thread(target=start_server, args=(args.recv_ip, args.recv_port))
-    server_thread.start()
-
-   # Ensure the server thread is properly joined before exiting
-    server_thread.join()
+    # Start the server on the transport's event loop thread
+    start_server(args.recv_ip, args.recv_port)
 
     # Configure OSC client
-    client = udp_client.SimpleUDPClient(args.send_ip, args.send_port)
+    client = get_transport().client(args.send_ip, args.send_port)
 
     # Query Ableton and create MIDI clip
     bpm, time_signature = query_ableton(client)
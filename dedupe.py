@@ -0,0 +1,184 @@
+# dedupe.py
+"""
+Near-duplicate detection for MELODY_/CHORDS_ pairs.
+
+DadaGP ships many transcriptions of the same song. Each pair is fingerprinted as
+a set of pitch/onset n-gram hashes, compressed into a MinHash signature and
+bucketed with LSH banding so only likely duplicates are ever compared.
+"""
+
+import os
+import zlib
+import numpy as np
+import pretty_midi as pm
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+def midi_to_onsets(midi_path):
+    """
+    Returns a sorted list of (onset_step, pitch) tuples for every non-drum note.
+    Onsets are quantized to 16th-note steps in MIDI ticks, so the result does not
+    depend on the file's tempo.
+    """
+    midi = pm.PrettyMIDI(midi_path)
+    onsets = []
+    for instrument in midi.instruments:
+        if instrument.is_drum:
+            continue
+        for note in instrument.notes:
+            beats = midi.time_to_tick(note.start) / midi.resolution
+            onsets.append((int(round(beats * 4)), note.pitch))
+    onsets.sort()
+    return onsets
+
+def melody_ngrams(onsets, n=4):
+    """
+    Melody n-grams of (pitch interval, onset delta). Using intervals instead of
+    absolute pitches makes transposed copies of the same tune hash the same.
+    """
+    steps = [(onsets[i][0] - onsets[i - 1][0], onsets[i][1] - onsets[i - 1][1])
+             for i in range(1, len(onsets))]
+    return [("m",) + tuple(steps[i:i + n]) for i in range(len(steps) - n + 1)]
+
+def chord_ngrams(onsets, n=3):
+    """
+    Chord n-grams of (bass movement, pitch classes relative to the bass, onset delta),
+    taken over groups of notes that start on the same step.
+    """
+    groups = []
+    for step, pitch in onsets:
+        if groups and groups[-1][0] == step:
+            groups[-1][1].append(pitch)
+        else:
+            groups.append((step, [pitch]))
+
+    steps = []
+    for i in range(1, len(groups)):
+        prev_bass = min(groups[i - 1][1])
+        bass = min(groups[i][1])
+        shape = tuple(sorted(set((p - bass) % 12 for p in groups[i][1])))
+        steps.append(((bass - prev_bass) % 12, shape, groups[i][0] - groups[i - 1][0]))
+    return [("c",) + tuple(steps[i:i + n]) for i in range(len(steps) - n + 1)]
+
+def pair_shingles(melody_path, chord_path=None, n=4):
+    """
+    Hashes the melody (and optional chord) n-grams of a pair into a unique uint64 array.
+    """
+    grams = melody_ngrams(midi_to_onsets(melody_path), n=n)
+    if chord_path is not None:
+        grams += chord_ngrams(midi_to_onsets(chord_path), n=max(1, n - 1))
+    hashes = [zlib.crc32(repr(g).encode()) for g in grams]
+    return np.unique(np.array(hashes, dtype=np.uint64))
+
+def make_permutations(num_perm=128, seed=1):
+    """Draws the (a, b) coefficients for num_perm universal hash functions."""
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+    b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+    return a, b
+
+def minhash_signature(shingles, permutations):
+    """
+    Computes the MinHash signature of a shingle set.
+    All hash functions are applied at once as a (num_perm, num_shingles) matrix.
+    """
+    a, b = permutations
+    if len(shingles) == 0:
+        return np.full(len(a), MERSENNE_PRIME, dtype=np.uint64)
+    x = shingles % np.uint64(MERSENNE_PRIME)
+    hashed = (a[:, None] * x[None, :] + b[:, None]) % np.uint64(MERSENNE_PRIME)
+    return hashed.min(axis=1)
+
+def lsh_candidate_pairs(signatures, bands=16, rows=8):
+    """
+    Buckets signatures band by band and returns the set of key pairs that share
+    at least one bucket. Only these pairs are ever compared, so the cost grows with
+    the number of songs rather than the number of song pairs.
+    """
+    candidates = set()
+    keys = list(signatures.keys())
+    for band in range(bands):
+        buckets = {}
+        for key in keys:
+            band_bytes = signatures[key][band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(band_bytes, []).append(key)
+        for bucket in buckets.values():
+            if len(bucket) < 2:
+                continue
+            for i in range(len(bucket)):
+                for j in range(i + 1, len(bucket)):
+                    candidates.add((bucket[i], bucket[j]))
+    return candidates
+
+def find_near_duplicates(pairs, threshold=0.8, num_perm=128, bands=16, n=4, seed=1):
+    """
+    Finds near-duplicate songs among MELODY_/CHORDS_ pairs.
+
+    Args:
+        pairs: Dictionary of key -> (melody_path, chord_path). chord_path may be None.
+        threshold: Minimum estimated Jaccard similarity to count as a duplicate.
+        num_perm: Number of MinHash permutations. Must be divisible by bands.
+        bands: Number of LSH bands.
+        n: Melody n-gram length.
+        seed: Seed for the MinHash permutations.
+
+    Returns:
+        keep: Sorted list of keys to keep (one per duplicate cluster).
+        duplicates: Dictionary of dropped key -> (kept key, estimated similarity).
+    """
+    rows = num_perm // bands
+    permutations = make_permutations(num_perm, seed)
+
+    signatures = {}
+    for key, (melody_path, chord_path) in pairs.items():
+        try:
+            shingles = pair_shingles(melody_path, chord_path, n=n)
+        except Exception as e:
+            print(f"Could not fingerprint {key}: {e}")
+            continue
+        if len(shingles) == 0:
+            continue
+        signatures[key] = minhash_signature(shingles, permutations)
+
+    # Union-find over the verified candidate pairs.
+    parent = {key: key for key in signatures}
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    similarity = {}
+    for key_a, key_b in lsh_candidate_pairs(signatures, bands=bands, rows=rows):
+        estimate = float(np.mean(signatures[key_a] == signatures[key_b]))
+        if estimate >= threshold:
+            similarity[(key_a, key_b)] = similarity[(key_b, key_a)] = estimate
+            root_a, root_b = find(key_a), find(key_b)
+            if root_a != root_b:
+                # Keep the alphabetically first key as the cluster representative.
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    duplicates = {}
+    for key in signatures:
+        root = find(key)
+        if root != key:
+            duplicates[key] = (root, similarity.get((key, root), threshold))
+    keep = sorted(key for key in pairs if key not in duplicates)
+    return keep, duplicates
+
+def dedupe_pairs(directory, suffixes, threshold=0.8, **kwargs):
+    """
+    Runs near-duplicate detection over the MELODY_<suffix>/CHORDS_<suffix> pairs in
+    directory, prints a report and returns the suffixes to keep.
+    """
+    pairs = {}
+    for suffix in suffixes:
+        chord_path = os.path.join(directory, "CHORDS_" + suffix)
+        pairs[suffix] = (os.path.join(directory, "MELODY_" + suffix),
+                         chord_path if os.path.exists(chord_path) else None)
+
+    keep, duplicates = find_near_duplicates(pairs, threshold=threshold, **kwargs)
+    for dup, (kept, estimate) in sorted(duplicates.items()):
+        print(f"Near-duplicate ({estimate:.2f}): {dup}  -->  keeping {kept}")
+    print(f"Dedupe: {len(suffixes)} pairs, {len(duplicates)} near-duplicates dropped, {len(keep)} kept.")
+    return keep
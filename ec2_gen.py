@@ -1,42 +1,162 @@
 import numpy as np
 import torch
+import contextlib
 import pretty_midi as pm
 import matplotlib.pyplot as plt
 import sys
 import os
 import pickle
 import random
+import time
 from pprint import pprint
 
 sys.path.append('../icm-deep-music-generation')
 from ec2vae.model import EC2VAE
+from ec2vae_artifact import load_artifact
 from pickler import process_directory_to_ec2vae_pickle, midi_to_melody_array, m21_to_one_hot
 import chords
-from melody import rule_based_melody, remix
+from melody import rule_based_melody, remix, melody_to_array
+from osc_utils import split_rows_by_size, chunk_relative_times, MTU_MAX_PACKET_SIZE
+
+def thread_candidates():
+    """Intra-op thread counts worth trying on this machine: powers of two up to the core count, and the core count."""
+    cores = os.cpu_count() or 1
+    return sorted({2**i for i in range(cores.bit_length()) if 2**i <= cores} | {cores})
+
+class GenerationCancelled(Exception):
+    """Raised at a window boundary when a generation's cancel event has been set."""
+    pass
+
+def check_cancelled(cancel_event, where=""):
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled(f"Generation cancelled{' ' + where if where else ''}")
+
+def score_candidates(predictions, in_car, pitch_range=(50, 68), target_density=1.0, weights=(0.5, 0.3, 0.2)):
+    """
+    Cheap, vectorized scores for N candidate predictions of the same take.
+
+    Args:
+        predictions: (N, L) EC2 arrays (0-127 pitch onsets, 128 sustain, 129 rest).
+        in_car: (L, 12) input chord array from m21_to_one_hot (one chord per beat in the
+                first 3 of every 4 rows).
+        pitch_range: GuitarBot's playable range; pitches outside it get folded by octaves.
+        target_density: Preferred note onsets per beat.
+        weights: Weights of (chord-tone ratio, in-range ratio, density score).
+    Returns:
+        (scores, metrics) with scores shape (N,) and metrics a dict of (N,) arrays.
+    """
+    predictions = np.asarray(predictions)
+    length = predictions.shape[1]
+    # One chord per beat, spread over its 4 sixteenths
+    beat_chords = np.asarray(in_car[:length]).reshape(-1, 4, 12).max(axis=1)
+    chord_per_tick = np.repeat(beat_chords, 4, axis=0)
+    onsets = predictions < 128
+    num_onsets = onsets.sum(axis=1)
+    safe_onsets = np.maximum(num_onsets, 1)
+    pitch_classes = np.where(onsets, predictions, 0) % 12
+    is_chord_tone = np.take_along_axis(np.broadcast_to(chord_per_tick, predictions.shape + (12,)),
+                                       pitch_classes[..., None], axis=2)[..., 0] > 0
+    chord_tone_ratio = (is_chord_tone & onsets).sum(axis=1) / safe_onsets
+    in_range = onsets & (predictions >= pitch_range[0]) & (predictions <= pitch_range[1])
+    in_range_ratio = in_range.sum(axis=1) / safe_onsets
+    density = num_onsets / (length / 4)
+    density_score = np.clip(1 - np.abs(density - target_density) / target_density, 0, 1)
+    scores = weights[0] * chord_tone_ratio + weights[1] * in_range_ratio + weights[2] * density_score
+    scores = np.where(num_onsets > 0, scores, -1.0) # an all-rest candidate is never picked
+    metrics = {"chord_tone_ratio": chord_tone_ratio, "in_range_ratio": in_range_ratio, "density": density}
+    return scores, metrics
 
 class EC2Generator:
-    def __init__(self, model_path=None, pickle_path=None):
+    def __init__(self, model_path=None, pickle_path=None, cache=None, optimize=False, num_threads=None, artifact_path=None):
         """
         Initialize the EC2Generator with the model and data dictionary.
         
         Args:
             model_path: Path to the EC2VAE model parameters.
             pickle_path: Path to the pickled song data.
+            cache: Optional GenerationCache; repeated progressions are then served from it.
+            optimize: Opt-in CPU inference mode: dynamic int8 quantization of the GRU and
+                      Linear layers, and encode/decode under torch.inference_mode().
+            num_threads: Intra-op thread count for torch (None leaves torch's default, "auto"
+                         picks the fastest per window with tune_threads).
+            artifact_path: Directory written by ec2vae_artifact.export_artifact. If it exists,
+                           the traced encoder/decoder are loaded instead of rebuilding EC2VAE.
         """
+        self.cache = cache
+        self.window_time_estimate = None # running estimate of seconds per decoded window, for deadlines
+        self.speculator = None # set by Speculator; its pre-generated phrases are claimed on a cache miss
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.ec2vae_model = EC2VAE.init_model()
-        
-        # Load the model
-        if model_path:
-            self.ec2vae_model.load_model(model_path)
+        self.traced = artifact_path is not None and os.path.isdir(artifact_path)
+        if self.traced:
+            self.ec2vae_model = load_artifact(artifact_path, self.device)
         else:
-            default_path = './icm-deep-music-generation/ec2vae/model_param/ec2vae-v1.pt'
-            self.ec2vae_model.load_model(default_path)
+            self.ec2vae_model = EC2VAE.init_model()
         
+            # Load the model
+            if model_path:
+                self.ec2vae_model.load_model(model_path)
+            else:
+                default_path = './icm-deep-music-generation/ec2vae/model_param/ec2vae-v1.pt'
+                self.ec2vae_model.load_model(default_path)
+        
+        self.optimized = False
+        if num_threads is not None and num_threads != "auto":
+            torch.set_num_threads(num_threads)
+        if optimize:
+            self.optimize_for_cpu()
+
         # Load the data dictionary
         self.pickle_path = pickle_path or "./GP_Melody_Chords/ec2_with_UJB.pkl"
         self.data_dict = self.load_data_pickle()
+        if num_threads == "auto":
+            self.tune_threads()
         
+    def optimize_for_cpu(self):
+        """
+        Replaces the float32 GRUs, GRUCells and Linear layers with dynamically quantized int8 ones.
+        Only available on CPU; on a GPU the model is left as is.
+        """
+        if self.device.type != 'cpu':
+            print("Int8 dynamic quantization is CPU only, keeping the float32 model")
+            return
+        if self.traced:
+            print("The traced artifact can't be quantized after export, keeping it as is")
+            return
+        self.ec2vae_model.eval()
+        self.ec2vae_model = torch.ao.quantization.quantize_dynamic(
+            self.ec2vae_model, {torch.nn.GRU, torch.nn.GRUCell, torch.nn.Linear}, dtype=torch.qint8)
+        self.optimized = True
+        print(f"EC2VAE quantized to int8 ({torch.get_num_threads()} threads)")
+
+    def tune_threads(self, candidates=None, repeats=5, window_size=32):
+        """
+        Times decode_window on the first window of a reference song for each candidate
+        intra-op thread count and keeps the fastest. Returns {threads: seconds per window}.
+        """
+        if candidates is None:
+            candidates = thread_candidates()
+        song_data = next(iter(self.data_dict.values()))
+        arrays = self.prepare_windows(song_data["melody"], song_data["chords"], song_data["melody"], song_data["chords"], window_size)
+        window = tuple(array[:window_size] for array in arrays[:4])
+        timings = {}
+        for threads in candidates:
+            torch.set_num_threads(threads)
+            self.decode_window(*window) # warm up
+            times = []
+            for _ in range(repeats):
+                t_start = time.perf_counter()
+                self.decode_window(*window)
+                times.append(time.perf_counter() - t_start)
+            timings[threads] = float(np.median(times))
+        best = min(timings, key=timings.get)
+        torch.set_num_threads(best)
+        print(f"EC2VAE intra-op threads: {best} ({timings[best] * 1000:.2f} ms per window; tried {list(timings)})")
+        return timings
+
+    def inference_context(self):
+        """torch.inference_mode() in the optimized mode, otherwise a no-op context."""
+        return torch.inference_mode() if self.optimized else contextlib.nullcontext()
+
     def load_data_pickle(self):
         """
         Loads and returns the data dictionary from a pickle file.
@@ -135,72 +255,314 @@ class EC2Generator:
                 melody_array[i:i+window_size],
                 chord_array[i:i+window_size])
     
-    def generate_prediction_for_one_song(self, song_key, song_data, window_size=32, window_overlap=0, test_midi=None, whatif_melody=False):
-        """Generate prediction for one song."""
-        print(f"Processing song: {song_key}")
+    def decode_window(self, in_mar_window, in_car_window, mel_window, ch_window):
+        """Decode one window: the input's pitch latent with the reference's rhythm latent."""
+        with self.inference_context():
+            zp1, zr1, c1 = self.encode(in_mar_window, in_car_window, viz=False)
+            zp2, zr2, c2 = self.encode(mel_window, ch_window, viz=False)
+            return self.decode(zp1, zr2, c1, viz=False)
+
+    def analyse_song_input(self, song_key, song_data, test_midi=None, bpm=None):
+        """Chord analysis of the input on a bpm grid (None: the file's tempo). Returns the full chord list."""
+        source = test_midi if test_midi is not None else song_data.get("source_midi", song_key)
+        ms = chords.MIDI_Stream(source, bpm=bpm)
+        return ms.get_full_chord_list()
+
+    def prepare_song_input(self, song_key, song_data, window_size=32, test_midi=None, bpm=100, full_chords=None, write_midi=True):
+        """
+        Chord analysis and rule-based melody for the input, padded to whole windows together
+        with the reference arrays. Returns (rbm, in_mar, in_car, melody_array, chord_array, total_length).
+        With write_midi=False the rule-based melody never touches rule_based_melody.mid, so
+        background work can't race a real take over that file.
+        """
         melody_array = song_data["melody"]
         chord_array = song_data["chords"]
-        source = test_midi if test_midi is not None else song_data.get("source_midi", song_key)
-        
-        ms = chords.MIDI_Stream(source)
-        full_chords = ms.get_full_chord_list()
-        rbm, rbm_path = rule_based_melody(full_chords, bpm=100, debug=False)
-        in_mar = midi_to_melody_array(rbm_path)
+        if full_chords is None:
+            full_chords = self.analyse_song_input(song_key, song_data, test_midi, bpm=bpm)
+        rbm, rbm_path = rule_based_melody(full_chords, bpm=bpm, debug=False, write_midi=write_midi)
+        if write_midi:
+            in_mar = midi_to_melody_array(rbm_path)
+        else:
+            in_mar = melody_to_array(rbm, bpm=bpm) if rbm else np.full(len(full_chords) * 4, 129, dtype=int)
         in_car = m21_to_one_hot(full_chords)
         
         in_mar, in_car, melody_array, chord_array, total_length = self.prepare_windows(
             in_mar, in_car, melody_array, chord_array, window_size)
-        
+        return rbm, in_mar, in_car, melody_array, chord_array, total_length
+
+    def decode_batch(self, in_mar_windows, in_car_windows, mel_windows, ch_windows):
+        """
+        decode_window for a whole batch in one forward pass: every argument has the
+        batch (candidates x windows) in its first dimension.
+        """
+        with torch.no_grad(), self.inference_context():
+            m1h = np.zeros(in_mar_windows.shape + (130,), dtype=np.float32)
+            np.put_along_axis(m1h, in_mar_windows.astype(int)[..., None], 1., axis=-1)
+            r1h = np.zeros(mel_windows.shape + (130,), dtype=np.float32)
+            np.put_along_axis(r1h, mel_windows.astype(int)[..., None], 1., axis=-1)
+            pc1h = torch.from_numpy(np.asarray(in_car_windows, dtype=np.float32)).to(self.device)
+            rc1h = torch.from_numpy(np.asarray(ch_windows, dtype=np.float32)).to(self.device)
+            zp1, zr1 = self.ec2vae_model.encoder(torch.from_numpy(m1h).to(self.device), pc1h)
+            zp2, zr2 = self.ec2vae_model.encoder(torch.from_numpy(r1h).to(self.device), rc1h)
+            pred = self.ec2vae_model.decoder(zp1, zr2, pc1h)
+        return pred.cpu().numpy()
+
+    def generate_candidates(self, song_data, full_chords, reference_keys=None, seeds=(0, 1), window_size=32, bpm=100):
+        """
+        Generates one candidate per (reference song, rule-based seed) pair with every
+        window of every candidate folded into a single batched forward pass, then scores
+        them with score_candidates.
+
+        Args:
+            song_data: Data of the default reference song (used when reference_keys is None).
+            full_chords: Chord list of the input take.
+            reference_keys: Reference songs whose rhythm latents to try.
+            seeds: Seeds for the rule-based melody.
+        Returns:
+            A list of candidate dicts ("reference", "seed", "prediction", "rbm", "score",
+            plus the score metrics), best first.
+        """
+        references = [(key, self.data_dict[key]) for key in reference_keys] if reference_keys else [(None, song_data)]
+        in_car = m21_to_one_hot(full_chords)
+        melodies = []
+        random_state = random.getstate() # seeding must not change the live path's random sequence
+        try:
+            for seed in seeds:
+                random.seed(seed)
+                rbm, _ = rule_based_melody(full_chords, bpm=bpm, debug=False, write_midi=False)
+                in_mar = melody_to_array(rbm, bpm=bpm) if rbm else np.full(in_car.shape[0], 129, dtype=int)
+                melodies.append((seed, rbm, in_mar))
+        finally:
+            random.setstate(random_state)
+
+        candidates = []
+        batch = ([], [], [], [])
+        for reference_key, ref_data in references:
+            for seed, rbm, in_mar in melodies:
+                arrays = self.prepare_windows(in_mar, in_car, ref_data["melody"], ref_data["chords"], window_size)
+                num_windows = arrays[4] // window_size
+                for i, array in enumerate(arrays[:4]):
+                    batch[i].append(array[:num_windows * window_size].reshape((num_windows, window_size) + array.shape[1:]))
+                candidates.append({"reference": reference_key, "seed": seed, "rbm": rbm, "num_windows": num_windows})
+
+        # Candidates differ in length: num_windows follows each seed's rule-based melody length
+        max_windows = max(c["num_windows"] for c in candidates)
+        def stack(parts, fill=0):
+            padded = [np.concatenate((p, np.full((max_windows - len(p),) + p.shape[1:], fill, dtype=p.dtype))) for p in parts]
+            return np.concatenate(padded)
+        in_mar_b = stack(batch[0], fill=129) # padded windows are rests
+        in_car_b, mel_b, ch_b = [stack(parts) for parts in batch[1:]]
+
+        pred = self.decode_batch(in_mar_b, in_car_b, mel_b, ch_b)
+        predictions = pred.reshape(len(candidates), max_windows * window_size)
+        # The input chords are the same for every candidate; take them from in_car so no candidate
+        # is scored against another one's zero padding
+        input_chords = np.zeros((max_windows * window_size, in_car.shape[1]), dtype=in_car.dtype)
+        num_rows = min(len(in_car), len(input_chords))
+        input_chords[:num_rows] = in_car[:num_rows]
+        scores, metrics = score_candidates(predictions, input_chords)
+        for i, c in enumerate(candidates):
+            c["prediction"] = predictions[i, :c["num_windows"] * window_size]
+            c["score"] = float(scores[i])
+            for name, values in metrics.items():
+                c[name] = float(values[i])
+        candidates.sort(key=lambda c: c["score"], reverse=True)
+        return candidates
+
+    def generate_best_candidate(self, song_key, song_data, full_chords, reference_keys=None, seeds=(0, 1), window_size=32, bpm=100):
+        """Best of generate_candidates, as (prediction, pluck_message) like generate_prediction_for_one_song."""
+        start = time.time()
+        candidates = self.generate_candidates(song_data, full_chords, reference_keys, seeds, window_size, bpm)
+        best = candidates[0]
+        print(f"Best of {len(candidates)} candidates in {time.time() - start:.3f}s: reference {best['reference'] or song_key}, "
+              f"seed {best['seed']}, score {best['score']:.3f} (chord tones {best['chord_tone_ratio']:.2f}, "
+              f"in range {best['in_range_ratio']:.2f}, density {best['density']:.2f})")
+        gb = self.prediction_to_guitarbot(best["prediction"], bpm=bpm, default_speed=7, rbm=best["rbm"])
+        return best["prediction"], gb
+
+    def decode_prepared(self, prepared, window_size=32, window_overlap=0, cancel_event=None):
+        """
+        Decodes every window of the tuple returned by prepare_song_input into one prediction.
+        If cancel_event gets set, GenerationCancelled is raised at the next window boundary.
+        """
+        rbm, in_mar, in_car, melody_array, chord_array, total_length = prepared
         final_prediction = None
         num_windows = 0
         for window in self.iterate_windows(in_mar, in_car, melody_array, chord_array, window_size, window_overlap):
+            check_cancelled(cancel_event, f"before window {num_windows + 1}")
             num_windows += 1
-            in_mar_window, in_car_window, mel_window, ch_window = window
-            zp1, zr1, c1 = self.encode(in_mar_window, in_car_window, viz=False)
-            zp2, zr2, c2 = self.encode(mel_window, ch_window, viz=False)
-            prediction_window = self.decode(zp1, zr2, c1, viz=False)
+            prediction_window = self.decode_window(*window)
             
             if final_prediction is None:
                 final_prediction = prediction_window
             else:
                 final_prediction = np.concatenate((final_prediction, prediction_window))
-        
-        print(f"Processed {num_windows} windows for song: {song_key}")
-        gb = self.prediction_to_guitarbot(final_prediction, bpm=100, default_speed=7, rbm=rbm)
+        return final_prediction
+
+    def decode_with_deadline(self, prepared, deadline, window_size=32, reserve=0.05, cancel_event=None):
+        """
+        Decodes windows in order while the next one is still expected to finish before
+        deadline (a time.time() stamp) minus reserve seconds for post-processing. Windows
+        that don't make it are filled with the rule-based melody, so the prediction always
+        covers the whole take.
+
+        Returns:
+            (prediction, windows_decoded, num_windows)
+        """
+        rbm, in_mar, in_car, melody_array, chord_array, total_length = prepared
+        windows = []
+        for window in self.iterate_windows(in_mar, in_car, melody_array, chord_array, window_size):
+            check_cancelled(cancel_event, f"before window {len(windows) + 1}")
+            expected = self.window_time_estimate or 0.0
+            if time.time() + expected > deadline - reserve:
+                break
+            t_start = time.time()
+            windows.append(self.decode_window(*window))
+            elapsed = time.time() - t_start
+            if self.window_time_estimate is None:
+                self.window_time_estimate = elapsed
+            else:
+                self.window_time_estimate = 0.8 * self.window_time_estimate + 0.2 * elapsed
+        num_windows = total_length // window_size
+        filler = in_mar[len(windows) * window_size:total_length]
+        prediction = np.concatenate(windows + [filler]) if windows else np.array(filler)
+        return prediction, len(windows), num_windows
+
+    def generate_prediction_for_one_song(self, song_key, song_data, window_size=32, window_overlap=0, test_midi=None, whatif_melody=False, bpm=100, cancel_event=None, seed=None,
+                                         full_chords=None, use_cache=True, write_midi=True, deadline=None, info=None):
+        """
+        Generate prediction for one song at the given tempo.
+        If cancel_event (a threading.Event) gets set, GenerationCancelled is raised at the next window boundary.
+        seed, if given, seeds the rule-based melody and torch before generating.
+        full_chords skips the chord analysis of test_midi; use_cache=False bypasses the
+        generation cache and speculator pool.
+        deadline (a time.time() stamp) switches to decode_with_deadline: windows that can't
+        finish in time are replaced by the rule-based melody. If info is a dictionary it gets
+        "path" ("cache", "ec2", "ec2+filler" or "rule_based"), "windows" and "num_windows".
+        """
+        if info is None:
+            info = {}
+        print(f"Processing song: {song_key}")
+        if full_chords is None:
+            full_chords = self.analyse_song_input(song_key, song_data, test_midi, bpm=bpm)
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key, shift = self.cache.key_for(m21_to_one_hot(full_chords), song_key, window_size, window_overlap, seed, bpm)
+            cached = self.cache.get_generation(cache_key, shift)
+            if cached is None and self.speculator is not None:
+                cached = self.speculator.claim(cache_key, shift)
+                if cached is not None:
+                    self.cache.put_generation(cache_key, shift, *cached)
+            if cached is not None:
+                print(f"Generation cache hit for song: {song_key} (transposed {shift} semitones)")
+                prediction, rbm = cached
+                info.update(path="cache", windows=len(prediction) // window_size, num_windows=len(prediction) // window_size)
+                return prediction, self.prediction_to_guitarbot(prediction, bpm=bpm, default_speed=7, rbm=rbm)
+        if seed is not None:
+            random.seed(seed)
+            torch.manual_seed(seed)
+        prepared = self.prepare_song_input(song_key, song_data, window_size, test_midi, bpm, full_chords=full_chords, write_midi=write_midi)
+        rbm = prepared[0]
+        if deadline is None:
+            final_prediction = self.decode_prepared(prepared, window_size, window_overlap, cancel_event)
+            num_windows = len(final_prediction) // window_size
+            info.update(path="ec2", windows=num_windows, num_windows=num_windows)
+        else:
+            final_prediction, windows, num_windows = self.decode_with_deadline(prepared, deadline, window_size, cancel_event=cancel_event)
+            path = "ec2" if windows == num_windows else ("ec2+filler" if windows > 0 else "rule_based")
+            info.update(path=path, windows=windows, num_windows=num_windows)
+        print(f"Processed {info['windows']} of {info['num_windows']} windows for song: {song_key}")
+        gb = self.prediction_to_guitarbot(final_prediction, bpm=bpm, default_speed=7, rbm=rbm)
+        if cache_key is not None and info["path"] == "ec2":
+            self.cache.put_generation(cache_key, shift, final_prediction, rbm)
         return final_prediction, gb
+
+    def iter_pluck_chunks(self, prepared, window_size=32, bpm=100, default_speed=7, met_MNN=40, max_packet_size=MTU_MAX_PACKET_SIZE, cancel_event=None):
+        """
+        Generator over ready-to-send /Pluck chunks, decoded one window at a time so the
+        first phrase can go out while later windows are still being computed.
+
+        Each window gets its own metronome pulses and speed normalization. The first window
+        also carries the 4-beat count-in. Ontimes are chained like split_pluck_message: each
+        chunk's first ontime is relative to the last ontime of the chunk before it.
+
+        Args:
+            prepared: The tuple returned by prepare_song_input.
+            cancel_event: Optional threading.Event; once set, GenerationCancelled is raised
+                          before the next window is decoded.
+        Yields:
+            (window_index, chunk) with chunk a list of [note, duration, speed, ontime] rows.
+        """
+        rbm, in_mar, in_car, melody_array, chord_array, total_length = prepared
+        window_seconds = window_size / 4 * 60 / bpm
+        last_ontime = 0.0
+        for index, window in enumerate(self.iterate_windows(in_mar, in_car, melody_array, chord_array, window_size)):
+            check_cancelled(cancel_event, f"before window {index + 1}")
+            window_start = index * window_seconds
+            prediction_window = self.decode_window(*window)
+            # rbm rows carry song-time ontimes; the speed lookup works in window time
+            window_rbm = [row[:3] + [row[3] - window_start] for row in rbm] if rbm is not None else None
+            chunks, last_ontime = self.window_pluck_chunks(prediction_window, index, window_rbm, window_size, bpm,
+                                                           default_speed, met_MNN, max_packet_size, last_ontime)
+            for chunk in chunks:
+                yield index, chunk
+
+    def window_pluck_chunks(self, prediction_window, index, window_rbm=None, window_size=32, bpm=100, default_speed=7,
+                            met_MNN=40, max_packet_size=MTU_MAX_PACKET_SIZE, last_ontime=0.0):
+        """
+        /Pluck chunks of one decoded window, as iter_pluck_chunks sends them: count-in (first
+        window only), metronome pulses, speed normalization and ontimes chained onto
+        last_ontime, the absolute ontime of the previous window's last row.
+        window_rbm is the rule-based melody in window time. Returns (chunks, last_ontime).
+        """
+        tick_duration = 60 / bpm # quarter notes
+        window_seconds = window_size / 4 * tick_duration
+        countin = 4 * tick_duration
+        window_start = index * window_seconds
+        plucks, highest_speed = self.prediction_to_plucks(prediction_window, bpm=bpm, rbm=window_rbm,
+                                                          default_speed=default_speed, start_time=window_start + countin)
+        speed_add = 9 - (highest_speed if highest_speed > 0 else default_speed)
+
+        first_beat = 0 if index == 0 else int(round((window_start + countin) / tick_duration))
+        last_beat = int(round((window_start + window_seconds + countin) / tick_duration))
+        metronome = [[met_MNN, 0.1, 1, beat * tick_duration] for beat in range(first_beat, last_beat)]
+        gb_array = np.array(plucks + metronome, dtype=float).reshape(-1, 4)
+        gb_array = gb_array[np.argsort(gb_array[:, 3], kind="stable")]
+        if len(gb_array) == 0:
+            return [], last_ontime
+
+        num_rows = len(gb_array)
+        starts = split_rows_by_size("/Pluck", np.full(num_rows, 6), np.full(num_rows, 16), max_packet_size)
+        ends = np.append(starts[1:], num_rows)
+        ontimes = chunk_relative_times(gb_array[:, 3], starts)
+        ontimes[:ends[0]] -= last_ontime # chain onto the previous window's last chunk
+        rows = [list(row) for row in zip(gb_array[:, 0].astype(int).tolist(), np.round(gb_array[:, 1], 5).tolist(),
+                                         (gb_array[:, 2] + speed_add).astype(int).tolist(), np.round(ontimes, 5).tolist())]
+        return [rows[start:end] for start, end in zip(starts, ends)], gb_array[-1, 3]
     
-    def split_pluck_message(self, pluck_message, speed_offset, bpm):
-        """Split pluck message into chunks."""
-        pluck_message = np.array(pluck_message)
-        if len(pluck_message) < 40:
-            result = []
-            for row in pluck_message:
-                result.append([int(row[0]), round(float(row[1]), 5), int(row[2]), round(float(row[3]), 5)])
-            return result
-        
-        chunked_messages = []
-        chunk_size = 39
-        last_note = [0, 0, 0, 0]
-        pen_note = last_note
-        qnd = 60 / bpm # quarter note duration in seconds
-        # print("qnd: " + str(qnd))
-        
-        last_ot = 0
-        split_range = range(0, len(pluck_message), chunk_size)
-        for i in split_range:
-            chunk = pluck_message[i:i+chunk_size]
-            ot_offset = chunk[0, 3] - last_ot
-            last_ot = chunk[-1][3] # save last on time before offsetting
-            chunk[:, 3] = chunk[:, 3] - chunk[0, 3] + ot_offset
-            # Normalize the ontime to start from 0 + last note duration
-            chunk[:, 2] = chunk[:, 2] + speed_offset
-            result = []
-            for row in chunk:
-                result.append([int(row[0]), round(float(row[1]), 5), int(row[2]), round(float(row[3]), 5)])
-            chunk = result
-            chunked_messages.append(chunk)
-    
-        return chunked_messages
+    def split_pluck_message(self, pluck_message, speed_offset, bpm, max_packet_size=MTU_MAX_PACKET_SIZE):
+        """
+        Split pluck message into chunks that each fit in one /Pluck datagram.
+        Returns a flat list of rows if everything fits in one message.
+        """
+        pluck_message = np.array(pluck_message, dtype=float)
+        # Every row is sent as an [int, float, int, float] array: 6 type tags, 16 bytes.
+        num_rows = len(pluck_message)
+        starts = split_rows_by_size("/Pluck", np.full(num_rows, 6), np.full(num_rows, 16), max_packet_size)
+
+        notes = pluck_message[:, 0].astype(int)
+        durations = np.round(pluck_message[:, 1], 5)
+        if len(starts) == 1:
+            rows = zip(notes.tolist(), durations.tolist(), pluck_message[:, 2].astype(int).tolist(),
+                       np.round(pluck_message[:, 3], 5).tolist())
+            return [list(row) for row in rows]
+
+        # Normalize the ontimes of each chunk to start from the last ontime of the previous chunk
+        ontimes = np.round(chunk_relative_times(pluck_message[:, 3], starts), 5)
+        speeds = (pluck_message[:, 2] + speed_offset).astype(int)
+        rows = [list(row) for row in zip(notes.tolist(), durations.tolist(), speeds.tolist(), ontimes.tolist())]
+        ends = np.append(starts[1:], num_rows)
+        return [rows[start:end] for start, end in zip(starts, ends)]
     
     def insert_metronome_pulses(self, gb_array, bpm=100, met_MNN=40, countin=True, interleave=False):
         """Insert metronome pulses into the GB array."""
@@ -222,8 +584,11 @@ class EC2Generator:
         gb_array[:, 2] = gb_array[:, 2].astype(int)
         return gb_array
 
-    def prediction_to_guitarbot(self, ec2_array, bpm=100, rbm=None, default_speed=7):
-        """Convert EC2 array to GuitarBot pluck messages."""
+    def prediction_to_plucks(self, ec2_array, bpm=100, rbm=None, default_speed=7, start_time=0.0):
+        """
+        Convert an EC2 array to raw [note, duration, speed, ontime] rows.
+        Ontimes are offset by start_time. Returns the rows and the highest speed used.
+        """
         tick_duration = 60 / bpm / 4 # sixteenth notes
         pluck_message = []
         current_time = 0.0
@@ -265,10 +630,14 @@ class EC2Generator:
                         # print(f"New highest speed: {speed}")
                         highest_speed = speed
 
-                pluck_message.append([pitch, duration, speed, current_time])
+                pluck_message.append([pitch, duration, speed, current_time + start_time])
                 # Advance the current time by the duration of this note.
                 current_time += duration
-        
+        return pluck_message, highest_speed
+
+    def prediction_to_guitarbot(self, ec2_array, bpm=100, rbm=None, default_speed=7):
+        """Convert EC2 array to GuitarBot pluck messages."""
+        pluck_message, highest_speed = self.prediction_to_plucks(ec2_array, bpm=bpm, rbm=rbm, default_speed=default_speed)
         speed_add = 9 - highest_speed
         # print(f"Speed add: {speed_add}")
         # print(f"Highest speed: {highest_speed}")
@@ -0,0 +1,123 @@
+# ec2vae_artifact.py
+"""
+Pre-compiled EC2VAE for fast start-up.
+
+EC2Generator normally calls EC2VAE.init_model() and load_model() on the .pt parameter
+file, which rebuilds the Python module graph on every start. export_artifact() traces
+the encoder and decoder once (TorchScript, weights included) into a directory, and
+load_artifact() restores them without constructing EC2VAE at all. The loaded object
+has the same encoder/decoder interface as EC2VAE, so EC2Generator uses it as a drop-in
+replacement (EC2Generator(artifact_path=...)).
+
+Traced graphs are specialised to the window length they were exported with (32
+sixteenths by default); batch size stays free.
+
+Example:
+    python ec2vae_artifact.py export --model_path ./icm-deep-music-generation/ec2vae/model_param/ec2vae-v1.pt --out ./ec2vae_traced
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import torch
+
+sys.path.append('../icm-deep-music-generation')
+from ec2vae.model import EC2VAE
+
+ENCODER_FILE = "encoder.pt"
+DECODER_FILE = "decoder.pt"
+META_FILE = "meta.json"
+
+class _Encoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, melody_one_hot, chords):
+        return self.model.encoder(melody_one_hot, chords)
+
+class _Decoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, latent_pitch, latent_rhythm, chords):
+        return self.model.decoder(latent_pitch, latent_rhythm, chords)
+
+class TracedEC2VAE:
+    """Traced encoder/decoder with EC2VAE's interface (including its static note helpers)."""
+    note_array_to_notes = staticmethod(EC2VAE.note_array_to_notes)
+    chord_to_notes = staticmethod(EC2VAE.chord_to_notes)
+
+    def __init__(self, encoder, decoder, meta):
+        self.encoder_module = encoder
+        self.decoder_module = decoder
+        self.meta = meta
+
+    def encoder(self, melody_one_hot, chords):
+        return self.encoder_module(melody_one_hot, chords)
+
+    def decoder(self, latent_pitch, latent_rhythm, chords):
+        return self.decoder_module(latent_pitch, latent_rhythm, chords)
+
+    def eval(self):
+        return self
+
+def export_artifact(model_path, out_dir, window_size=32):
+    """Traces EC2VAE's encoder and decoder and saves them (with weights) to out_dir."""
+    model = EC2VAE.init_model()
+    model.load_model(model_path)
+    model.eval()
+    melody = torch.zeros(1, window_size, 130)
+    melody[:, :, 129] = 1. # all rests
+    chords = torch.zeros(1, window_size, 12)
+    os.makedirs(out_dir, exist_ok=True)
+    with torch.no_grad():
+        encoder = torch.jit.trace(_Encoder(model), (melody, chords), check_trace=False)
+        zp, zr = encoder(melody, chords)
+        decoder = torch.jit.trace(_Decoder(model), (zp, zr, chords), check_trace=False)
+    encoder = torch.jit.freeze(encoder.eval())
+    decoder = torch.jit.freeze(decoder.eval())
+    torch.jit.save(encoder, os.path.join(out_dir, ENCODER_FILE))
+    torch.jit.save(decoder, os.path.join(out_dir, DECODER_FILE))
+    meta = {"model_path": os.path.abspath(model_path), "window_size": window_size, "torch": torch.__version__}
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"Exported traced EC2VAE to {out_dir}")
+    return out_dir
+
+def load_artifact(artifact_dir, device=None):
+    """Loads an exported artifact. Returns a TracedEC2VAE."""
+    device = device or torch.device('cpu')
+    with open(os.path.join(artifact_dir, META_FILE)) as f:
+        meta = json.load(f)
+    encoder = torch.jit.load(os.path.join(artifact_dir, ENCODER_FILE), map_location=device)
+    decoder = torch.jit.load(os.path.join(artifact_dir, DECODER_FILE), map_location=device)
+    return TracedEC2VAE(encoder, decoder, meta)
+
+def _time_load(form, model_path, artifact_dir):
+    t_start = time.perf_counter()
+    if form == "artifact":
+        model = load_artifact(artifact_dir)
+    else:
+        model = EC2VAE.init_model()
+        model.load_model(model_path)
+        model.eval()
+    return model, time.perf_counter() - t_start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or load the traced EC2VAE artifact")
+    parser.add_argument("command", choices=["export", "time_load"])
+    parser.add_argument("--model_path", default='./icm-deep-music-generation/ec2vae/model_param/ec2vae-v1.pt')
+    parser.add_argument("--out", default="./ec2vae_traced", help="Artifact directory")
+    parser.add_argument("--window_size", type=int, default=32)
+    parser.add_argument("--form", choices=["pt", "artifact"], default="artifact", help="Model form for time_load")
+    args = parser.parse_args()
+    if args.command == "export":
+        export_artifact(args.model_path, args.out, args.window_size)
+    else:
+        # Used by bench_ec2_load.py to time a load in a fresh process
+        _, seconds = _time_load(args.form, args.model_path, args.out)
+        print(json.dumps({"form": args.form, "load_seconds": seconds}))
@@ -0,0 +1,113 @@
+# event_cache.py
+"""
+Cache of anticipation event tokens and detected tempo per MIDI file.
+
+anti.inpaint and anti.continuation convert their input with midi_to_events and parse
+it again with mido for detect_bpm on every request, even when the same take is
+inpainted or continued several times. EventCache keys both results by a hash of the
+file's bytes (so a rewritten file with the same name misses, and a copy under another
+name hits). Recent entries stay in memory; every entry is also written to
+directory/<hash>.npz as a compact integer array, so entries evicted from memory, or
+from an earlier run, are read back instead of converted.
+
+Example:
+    cache = EventCache(directory="./event_cache")
+    events, bpm = cache.get("take.mid")  # converts and stores
+    events, bpm = cache.get("take.mid")  # from memory
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from anticipation.convert import midi_to_events
+from midi_utils import detect_bpm
+
+def file_key(midi_file_path):
+    """SHA-1 of the file contents."""
+    h = hashlib.sha1()
+    with open(midi_file_path, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def compact_tokens(events):
+    """Event tokens as the smallest unsigned integer array that holds them."""
+    tokens = np.asarray(events, dtype=np.int64)
+    dtype = np.uint16 if tokens.size == 0 or tokens.max() < 2**16 else np.uint32
+    return tokens.astype(dtype)
+
+class EventCache:
+    def __init__(self, max_entries=64, directory=None):
+        """
+        Args:
+            max_entries: Conversions kept in memory before the least recently used is dropped.
+            directory: Where every conversion is also stored as <hash>.npz, created on the
+                       first store. None keeps the cache in memory only.
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict() # key -> (token array, bpm or None)
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+    def get(self, midi_file_path):
+        """Returns (events, bpm) for a MIDI file. events is a new list each call; bpm may be None."""
+        key = file_key(midi_file_path)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats["memory_hits"] += 1
+        if entry is None:
+            entry = self._load(key)
+            if entry is not None:
+                self.stats["disk_hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                entry = (compact_tokens(midi_to_events(midi_file_path)), detect_bpm(midi_file_path))
+                self._save(key, entry)
+            self._remember(key, entry)
+        tokens, bpm = entry
+        return tokens.tolist(), bpm
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False) # still on disk
+                self.stats["evictions"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _load(self, key):
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with np.load(self._path(key)) as data:
+                bpm = float(data["bpm"])
+                return data["events"], (None if np.isnan(bpm) else bpm)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load cached events from {self._path(key)}: {e}")
+            return None
+
+    def _save(self, key, entry):
+        if self.directory is None:
+            return
+        tokens, bpm = entry
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._path(key) + ".tmp.npz"
+        np.savez(tmp_path, events=tokens, bpm=np.float64(np.nan if bpm is None else bpm))
+        os.replace(tmp_path, self._path(key))
+
+    def clear(self):
+        """Empties the in-memory part; files on disk are kept."""
+        with self._lock:
+            self.entries.clear()
+
+    def print_stats(self):
+        print(f"Event cache: {len(self.entries)}/{self.max_entries} in memory, "
+              f"{self.stats['memory_hits']} memory hits, {self.stats['disk_hits']} disk hits, "
+              f"{self.stats['misses']} conversions, {self.stats['evictions']} evictions")
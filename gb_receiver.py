@@ -0,0 +1,149 @@
+# gb_receiver.py
+"""
+Local stand-in for GuitarBot's OSC receiver (192.168.1.1:12000 on the robot).
+
+Implements the contract main.py targets:
+    /Chords  [[chord name, ontime], ...]
+    /Strum   [[direction, ontime], ...]
+    /Pluck   [[midi note, duration, speed, ontime], ...]  (possibly several chunks)
+Plain messages and time-tagged bundles are both accepted. Every message is logged
+with its arrival time, so timing changes can be measured without the robot.
+"""
+
+import argparse
+import socket
+import threading
+import time
+from pythonosc.osc_packet import OscPacket, ParseError
+from pythonosc.osc_bundle import OscBundle
+
+ADDRESS_FIELDS = {
+    "/Chords": ("chord", "ontime"),
+    "/Strum": ("direction", "ontime"),
+    "/Pluck": ("note", "duration", "speed", "ontime"),
+}
+
+def decode_rows(address, params):
+    """
+    Decodes the rows of a GuitarBot message into dictionaries.
+    Raises ValueError if a row does not match the contract for the address.
+    """
+    fields = ADDRESS_FIELDS[address]
+    rows = []
+    for row in params:
+        if not isinstance(row, list) or len(row) != len(fields):
+            raise ValueError(f"{address}: malformed row {row!r}, expected {fields}")
+        rows.append(dict(zip(fields, row)))
+    return rows
+
+class GuitarBotReceiver:
+    def __init__(self, ip="127.0.0.1", port=12000, verbose=True):
+        """
+        Initialize the receiver.
+
+        Args:
+            ip: IP to listen on.
+            port: Port to listen on (GuitarBot uses 12000).
+            verbose: If True, prints every decoded message.
+        """
+        self.ip = ip
+        self.port = port
+        self.verbose = verbose
+        self.log = [] # dicts with arrival, timetag, address, rows
+        self.errors = []
+        self._lock = threading.Condition()
+        self._sock = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Binds the socket and starts receiving in a daemon thread."""
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((self.ip, self.port))
+        self._sock.settimeout(0.1)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        print(f"GuitarBot receiver listening on {self.ip}:{self.port}")
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        if self._sock is not None:
+            self._sock.close()
+
+    def _serve(self):
+        while self._running:
+            try:
+                data, _ = self._sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            arrival = time.time()
+            try:
+                packet = OscPacket(data)
+            except ParseError as e:
+                self.errors.append((arrival, str(e)))
+                print(f"Could not parse packet: {e}")
+                continue
+            # Plain messages have no timetag; bundles carry the time they should be played at
+            is_bundle = OscBundle.dgram_is_bundle(data)
+            for timed_message in packet.messages:
+                timetag = timed_message.time if is_bundle else None
+                self._handle(arrival, len(data), timetag, timed_message.message)
+
+    def _handle(self, arrival, size, timetag, message):
+        address = message.address
+        if address not in ADDRESS_FIELDS:
+            self.errors.append((arrival, f"Unknown address {address}"))
+            print(f"Unknown address: {address}")
+            return
+        try:
+            rows = decode_rows(address, message.params)
+        except ValueError as e:
+            self.errors.append((arrival, str(e)))
+            print(e)
+            return
+        entry = {"arrival": arrival, "timetag": timetag, "address": address, "rows": rows, "bytes": size}
+        with self._lock:
+            self.log.append(entry)
+            self._lock.notify_all()
+        if self.verbose:
+            when = "immediately" if timetag is None else f"at {timetag:.3f} ({timetag - arrival:+.3f}s)"
+            print(f"[{arrival:.3f}] {address}: {len(rows)} rows, play {when}")
+
+    def wait_for(self, address, after=0.0, timeout=None):
+        """
+        Blocks until a message for address arrives after the given time.time() stamp.
+        Returns the log entry, or None on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while True:
+                for entry in self.log:
+                    if entry["address"] == address and entry["arrival"] >= after:
+                        return entry
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._lock.wait(remaining)
+
+    def messages_since(self, after):
+        with self._lock:
+            return [entry for entry in self.log if entry["arrival"] >= after]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local GuitarBot OSC receiver stand-in")
+    parser.add_argument("--ip", default="127.0.0.1", help="The IP to listen on")
+    parser.add_argument("--port", type=int, default=12000, help="The port to listen on")
+    args = parser.parse_args()
+
+    receiver = GuitarBotReceiver(args.ip, args.port).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        receiver.stop()
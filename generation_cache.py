@@ -0,0 +1,178 @@
+# generation_cache.py
+"""
+Bounded LRU cache of EC2 generations.
+
+In a looping jam NeuralNote keeps handing us the same progression, and every take
+reruns the rule-based melody, the EC2 encode/decode and the post-processing. The
+chord one-hot array from m21_to_one_hot is computed before all of that, so it is
+used (together with the reference song, window settings, tempo and RNG seed) as the
+cache key, and a repeated progression returns its prediction straight from memory;
+only the cheap pluck post-processing is redone.
+
+With seed=None the generation itself is random (rule-based melody picks chord tones
+at random), so a hit replays the variant generated the first time.
+
+Keys are transposition invariant: the chord rows are rotated to a canonical key
+first (canonical_transposition), and entries hold the prediction and rule-based
+melody in that canonical key. A hit is shifted back to the key that was played, so
+the same progression in all twelve keys shares one entry.
+"""
+
+import atexit
+import copy
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+import numpy as np
+
+def canonical_transposition(in_car):
+    """
+    Rotates the 12-dim chord rows to a canonical key: of the twelve rotations, the one
+    whose bytes sort first. Returns (shift, canonical) with
+    canonical = np.roll(in_car, -shift, axis=1), i.e. the input is shift semitones above it.
+    """
+    in_car = np.ascontiguousarray(in_car)
+    rotations = [np.ascontiguousarray(np.roll(in_car, -shift, axis=1)) for shift in range(12)]
+    shift = min(range(12), key=lambda i: rotations[i].tobytes())
+    return shift, rotations[shift]
+
+def transpose_prediction(prediction, semitones):
+    """
+    Shifts the pitches (0-127) of an EC2 output array by semitones, leaving the
+    sustain (128) and rest (129) markers alone. Out of range pitches move by octaves.
+    """
+    prediction = np.array(prediction)
+    pitched = prediction < 128
+    shifted = prediction[pitched] + semitones
+    shifted[shifted < 0] += 12 * ((-shifted[shifted < 0] + 11) // 12)
+    shifted[shifted > 127] -= 12 * ((shifted[shifted > 127] - 127 + 11) // 12)
+    prediction[pitched] = shifted
+    return prediction
+
+def transpose_plucks(pluck_message, semitones):
+    """Shifts the note column of [note, duration, speed, ontime] rows. Speeds are kept."""
+    if pluck_message is None:
+        return None
+    return [[row[0] + semitones] + list(row[1:]) for row in pluck_message]
+
+class GenerationCache:
+    def __init__(self, max_entries=128, path=None, autosave=True, transpose_invariant=True):
+        """
+        Args:
+            max_entries: Number of generations kept before the least recently used is evicted.
+            path: Optional pickle file. Entries are loaded from it on start and, with
+                  autosave, written back when the process exits.
+            autosave: Save to path at exit.
+            transpose_invariant: Share one entry between transpositions of a progression.
+        """
+        self.max_entries = max_entries
+        self.transpose_invariant = transpose_invariant
+        self.path = path
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+            if autosave:
+                atexit.register(self.save)
+
+    @staticmethod
+    def make_key(in_car, song_key, window_size=32, window_overlap=0, seed=None, bpm=100):
+        """Hash of the chord one-hot array plus everything else that changes the generation."""
+        in_car = np.ascontiguousarray(in_car)
+        h = hashlib.sha1()
+        h.update(str((in_car.shape, in_car.dtype.str)).encode())
+        h.update(in_car.tobytes())
+        h.update(repr((song_key, window_size, window_overlap, seed, float(bpm))).encode())
+        return h.hexdigest()
+
+    def key_for(self, in_car, song_key, window_size=32, window_overlap=0, seed=None, bpm=100):
+        """
+        Returns (key, shift): the cache key of the canonical transposition of in_car and
+        the number of semitones the input sits above it (always 0 without transpose_invariant).
+        """
+        shift = 0
+        if self.transpose_invariant:
+            shift, in_car = canonical_transposition(in_car)
+        return self.make_key(in_car, song_key, window_size, window_overlap, seed, bpm), shift
+
+    def get_generation(self, key, shift):
+        """Returns the cached (prediction, rbm) shifted into the played key, or None on a miss."""
+        cached = self.get(key)
+        if cached is None:
+            return None
+        prediction, rbm = cached
+        return transpose_prediction(prediction, shift), transpose_plucks(rbm, shift)
+
+    def put_generation(self, key, shift, prediction, rbm):
+        """Stores a generation made in the played key under its canonical key."""
+        self.put(key, (transpose_prediction(prediction, -shift), transpose_plucks(rbm, -shift)))
+
+    def get(self, key):
+        """Returns a copy of the cached value, or None on a miss."""
+        with self._lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+        # Callers mutate pluck rows in place, so never hand out the stored objects
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        with self._lock:
+            self.entries[key] = copy.deepcopy(value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def contains(self, key):
+        """Membership test that doesn't count as a lookup or refresh the entry."""
+        with self._lock:
+            return key in self.entries
+
+    def pop(self, key):
+        """Removes and returns an entry (None if absent) without touching the stats."""
+        with self._lock:
+            return self.entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def print_stats(self):
+        print(f"Generation cache: {len(self.entries)}/{self.max_entries} entries, "
+              f"{self.stats['hits']} hits, {self.stats['misses']} misses "
+              f"({self.hit_rate * 100:.1f}% hit rate), {self.stats['evictions']} evictions")
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                entries = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"Could not load generation cache from {self.path}: {e}")
+            return
+        with self._lock:
+            self.entries = OrderedDict(list(entries.items())[-self.max_entries:])
+        print(f"Loaded {len(self.entries)} cached generations from {self.path}")
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            entries = OrderedDict(self.entries)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entries, f)
+        os.replace(tmp_path, self.path)
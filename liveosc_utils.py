@@ -1,4 +1,7 @@
+import mido
 from midi_utils import *
+from osc_utils import pack_args, osc_message_size, LOCALHOST_MAX_PACKET_SIZE
+from osc_transport import ABLETON_IP, ABLETON_PORT, get_transport
 # from anti import interact
 
 def midi_to_liveosc(client, file_path, segmented_sends=False, input_offset=0):
@@ -40,18 +43,29 @@ def anti_to_liveosc(client, file_path, clip_index=1):
         return
     send_midi(client, file_path, fire_immediately=False, clip_index=clip_index)
     
-def send_midi(client, file_path, bpm=120, timesig=[4, 4], fire_immediately=False, time_offset=0, track_index=0, clip_index=0, file_idx=0):
+def send_midi(client, file_path, bpm=120, timesig=[4, 4], fire_immediately=False, time_offset=0, track_index=0, clip_index=0, file_idx=0, max_packet_size=LOCALHOST_MAX_PACKET_SIZE):
     """
     Sends the MIDI note events in file_path to Ableton via OSC.
     If a time_offset (in beats) is provided, it will be added to each note event's start time.
+    Notes are packed into as few /live/clip/add/notes messages as fit under max_packet_size.
 
-    :param client: OSC client.
+    :param client: OSC client, or None for a client for Live on the shared OSC transport.
     :param file_path: Path to the MIDI file.
     :param bpm: Beats per minute.
     :param timesig: Time signature as [beats_per_bar, note_value].
     :param fire_immediately: If True, the clip is fired immediately.
     :param time_offset: Offset (in beats) added to all note events.
+    :param max_packet_size: Maximum size in bytes of a single OSC datagram.
+    :return: Dictionary with the number of packets and bytes sent for the clip, or None on failure.
     """
+    stats = {"packets": 0, "bytes": 0, "notes": 0}
+    def send(address, args):
+        client.send_message(address, args)
+        stats["packets"] += 1
+        stats["bytes"] += osc_message_size(address, args)
+
+    if client is None:
+        client = get_transport().client(ABLETON_IP, ABLETON_PORT)
     try:
         midi_file = mido.MidiFile(file_path)
         # Calculate clip length in beats using MIDI file length
@@ -61,7 +75,7 @@ def send_midi(client, file_path, bpm=120, timesig=[4, 4], fire_immediately=False
         if not file_idx == 1:
             clip_length = 16
             print(f"Creating new clip at track {track_index}, clip {clip_index}, length {clip_length}")
-            client.send_message("/live/clip_slot/create_clip", [track_index, clip_index, clip_length])
+            send("/live/clip_slot/create_clip", [track_index, clip_index, clip_length])
 
         active_notes = {}  # note -> (start_time, velocity)
         note_events = []   # List to store note events
@@ -80,19 +94,22 @@ def send_midi(client, file_path, bpm=120, timesig=[4, 4], fire_immediately=False
                     effective_start = start_time + time_offset
                     effective_end = current_time_in_beats + time_offset
                     duration = effective_end - effective_start
-                    note_events.append((track_index, clip_index, msg.note, effective_start, duration, velocity, 0))
+                    note_events.append((msg.note, float(effective_start), float(duration), velocity, 0))
 
-        # Send note events to Ableton
-        for event in note_events:
-            client.send_message("/live/clip/add/notes", list(event))
+        # Send note events to Ableton, as many notes per message as fit in one datagram
+        for args in pack_args("/live/clip/add/notes", [track_index, clip_index], note_events, max_packet_size):
+            send("/live/clip/add/notes", args)
+        stats["notes"] = len(note_events)
         if not (time_offset == 0):
-            client.send_message("/live/clip/set/loop_start", [track_index, clip_index, 8])
-            client.send_message("/live/clip/set/loop_end", [track_index, clip_index, 24])
+            send("/live/clip/set/loop_start", [track_index, clip_index, 8])
+            send("/live/clip/set/loop_end", [track_index, clip_index, 24])
         else:
-            client.send_message("/live/clip/set/loop_end", [track_index, clip_index, clip_length * 4])
+            send("/live/clip/set/loop_end", [track_index, clip_index, clip_length * 4])
         if fire_immediately: # honestly this stuff should happen outside of this file
             print("Fire away!")
-            client.send_message("/live/clip/fire", [track_index, clip_index])
+            send("/live/clip/fire", [track_index, clip_index])
         print(f"Loaded MIDI file: {file_path} (offset {time_offset} beats)")
+        print(f"Sent {stats['notes']} notes in {stats['packets']} packets ({stats['bytes']} bytes) to clip {track_index}:{clip_index}")
+        return stats
     except Exception as e:
         print(f"Failed to load MIDI file: {e}")
\ No newline at end of file
@@ -3,9 +3,9 @@ import subprocess
 import os
 import threading
 from pythonosc.dispatcher import Dispatcher
-from pythonosc import osc_server, udp_client
+from osc_transport import get_transport
 from watcher import watch_directory
-from model_loader import load_model
+from model_loader import DEFAULT_MEMORY_BUDGET, registry as model_registry
 from midi_utils import validate_midi_file, get_total_bars, save_midi_file
 # from anti import inpaint, continuation
 import synth
@@ -17,32 +17,110 @@ import torch
 from ec2_gen import EC2Generator 
 from utils import *
 from liveosc_utils import *
+from osc_utils import pack_bundles, MTU_MAX_PACKET_SIZE
+from clip_maker import LiveTempoState
+from streaming import StreamingEC2Session, follow_midi_file
+from pipeline import TakePipeline, LatestWins
+from generation_cache import GenerationCache
+from speculator import Speculator
+from ec2_gen import GenerationCancelled, check_cancelled
 
 playing_position = -1.0
+scene = 0
+last_take_times = {} # time.time() stamps of the pipeline stages for the most recently started take (each take writes its own dict)
+bundle_mode = False # send /Chords, /Strum and /Pluck as one time-tagged OSC bundle
+live_state = LiveTempoState(default_bpm=100) # tempo/time signature pushed by AbletonOSC listeners
+progressive_mode = False # send each window's /Pluck chunks as soon as they are decoded
+best_of_mode = False # generate several candidates in one batched pass and send the best scoring one
+best_of_references = None # reference songs to try in best_of_mode (None: just the selected one)
+best_of_seeds = (0, 1, 2) # rule-based melody seeds to try in best_of_mode
+deadline_mode = False # never let EC2 run past the next usable downbeat; fall back to the rule-based melody
+streaming_mode = False # experimental: follow the file and send each window as it is decoded (see streaming.py)
+pipeline_mode = False # run takes through the staged TakePipeline instead of one by one on the watcher thread
+latest_wins = LatestWins() # a new take from the same directory cancels the one still generating
 
-def midi_to_GB_UDP(midi_file_path):
+def midi_to_GB_UDP(midi_file_path, bundle=None, progressive=None, cancel_event=None, deadline=None):
     print("/" + "="*50 + "/")
     print("midi_to_GB_UDP()")
     print("/" + "="*50 + "/\n")
 
-    global scene
+    global scene, last_take_times
+    times = {"file": midi_file_path, "start": time.time()} # this take's own stamps, overlapping takes don't share them
+    last_take_times = times
     print(f"Scene: {scene}")
     # ableton_client.send_message("/live/clip/get/playing_position", [2, 2]) # Click track, current scene
     global ec2_generator  # Add global declaration here too
-    midi_stream = MIDI_Stream(midi_file_path)
+    bpm, time_signature = live_state.snapshot() # no query round trip, falls back to 100 bpm without Live
+    # chord analysis on Live's tempo grid, the same one the melody and plucks use
+    midi_stream = MIDI_Stream(midi_file_path, bpm=bpm, timesig=list(time_signature))
     song_key, melody_array, chord_array, song_data = ec2_generator.song_select('Grateful Dead - Uncle Johns Band.mid')
     
     chords, strum, pluck, full_chords = midi_stream.get_UDP_lists()
     full_chords = midi_stream.get_full_chord_list()
+    times["parsed"] = time.time()
+    if speculator is not None:
+        speculator.observe(full_chords, bpm) # what to pre-generate once this take is out
+    if bundle is None:
+        bundle = bundle_mode
+    if progressive is None:
+        progressive = progressive_mode
+    if progressive:
+        return send_progressive(midi_file_path, song_key, song_data, chords, bpm, bundle, cancel_event, times=times,
+                                full_chords=full_chords)
+    play_at = None
+    if deadline is None and deadline_mode:
+        # Generation has to be done in time to send for the next usable downbeat
+        play_at = next_downbeat(60 / bpm, time_signature[0])
+        deadline = play_at - 0.35 # 0.35 is set latency
     start = time.time()
-    prediction, pluck_message = ec2_generator.generate_prediction_for_one_song(song_key, song_data, window_size=32, window_overlap=0, test_midi=midi_file_path)
+    info = {}
+    if best_of_mode:
+        prediction, pluck_message = ec2_generator.generate_best_candidate(song_key, song_data, full_chords, reference_keys=best_of_references,
+                                                                          seeds=best_of_seeds, window_size=32, bpm=bpm)
+        deadline = None # a single batched pass, nothing to fall back from
+    else:
+        prediction, pluck_message = ec2_generator.generate_prediction_for_one_song(song_key, song_data, window_size=32, window_overlap=0, test_midi=midi_file_path, bpm=bpm, cancel_event=cancel_event,
+                                                                                   full_chords=full_chords, deadline=deadline, info=info,
+                                                                                   write_midi=False) # concurrent takes must not share rule_based_melody.mid
     end = time.time()
+    times["generated"] = end
     print("Time taken for prediction generation: ", end-start)
+    if deadline is not None:
+        slack = deadline - end
+        times.update(path=info["path"], slack=slack)
+        print(f"Path: {info['path']} ({info['windows']}/{info['num_windows']} EC2 windows), slack: {slack * 1000:.1f} ms")
     # pprint(prediction)
     # pluck_message = ec2_generator.prediction_to_guitarbot(prediction, bpm=120, default_speed=7, rbm=None)
+    check_cancelled(cancel_event, "before sending") # don't send a stale phrase
+    send_plucks(chords, strum, pluck_message, bpm, bundle, play_at=play_at, times=times)
+
+def next_downbeat(bpm_secs, beats_per_bar=4, min_lead=0.4):
+    """
+    time.time() of the next downbeat in Live that is at least min_lead seconds away
+    (enough for the set latency), derived from the transport's playing position.
+    """
+    t_record, overall_wait = time_to_next_beat(bpm_secs, beats_per_bar)
+    bar_secs = bpm_secs * beats_per_bar
+    wait = overall_wait - (time.time() - t_record)
+    while wait < min_lead:
+        wait += bar_secs
+    return time.time() + wait
+
+def send_plucks(chords, strum, pluck_message, bpm, bundle=False, play_at=None, times=None):
+    """
+    Sends a generated take to GuitarBot on the next beat (or as a bundle scheduled for it).
+    play_at (a time.time() stamp) overrides the next beat, e.g. for a deadline's downbeat.
+    times is the take's dict of pipeline stamps.
+    """
+    if times is None:
+        times = {}
     chords_list = [list(item) for item in chords]
     strum_list = [list(item) for item in strum]
-    pluck_list = [list(item) for item in pluck_message]
+    # split_pluck_message returns a flat list of rows, or a list of chunks for long phrases
+    if len(pluck_message) > 0 and isinstance(pluck_message[0][0], list):
+        pluck_chunks = [[list(row) for row in chunk] for chunk in pluck_message]
+    else:
+        pluck_chunks = [[list(item) for item in pluck_message]]
     # print(chords_list)
     # print(strum_list)
 
@@ -50,7 +128,8 @@ def midi_to_GB_UDP(midi_file_path):
 
     empty_chord = chords_list[-1]
     empty_chord[0] = 'On'
-    empty_chord[1] = pluck_list[-1][3] # set the ontime chord to the last pluck message ontime
+    # set the ontime chord to the last pluck ontime: chunk ontimes are chained, so sum each chunk's last one
+    empty_chord[1] = round(sum(chunk[-1][3] for chunk in pluck_chunks if chunk), 5)
     empty_strum = ['UP', 0.0]
     empty_chord = [empty_chord]
     empty_strum = [empty_strum]
@@ -58,31 +137,202 @@ def midi_to_GB_UDP(midi_file_path):
     pprint(empty_strum)
     pprint(pluck_message)
 
-    bpm_secs = 60 / 100 # default bpm for now but we can easily query this from osc
+    bpm_secs = 60 / bpm
+    if play_at is None:
+        t_record, overall_wait = time_to_next_beat(bpm_secs)
+    else:
+        t_record, overall_wait = time.time(), max(play_at - time.time(), 0.0)
+    if bundle:
+        # Send right away and let GuitarBot schedule everything for the next beat
+        messages = [("/Chords", empty_chord), ("/Strum", empty_strum)]
+        messages += [("/Pluck", chunk) for chunk in pluck_chunks]
+        bundles = pack_bundles(messages, t_record + overall_wait, MTU_MAX_PACKET_SIZE)
+        times["send_start"] = time.time()
+        for b in bundles:
+            client.send(b)
+        times["first_sent"] = times["sent"] = time.time()
+        print(f"Sent {len(messages)} messages in {len(bundles)} bundle(s) for t={t_record + overall_wait:.3f}")
+        return
+    wait_until(t_record + overall_wait - 0.35) # 0.35 is set latency
+    times["send_start"] = time.time()
+    client.send_message("/Chords", empty_chord)
+    client.send_message("/Strum", empty_strum)
+    for chunk in pluck_chunks: # one /Pluck per MTU-sized chunk from split_rows_by_size
+        client.send_message("/Pluck", chunk)
+        times.setdefault("first_sent", time.time())
+    times["sent"] = time.time()
+    print("Sent")
+    # .35 seconds of delay between sent message and it being played
+
+def send_progressive(midi_file_path, song_key, song_data, chords, bpm, bundle, cancel_event=None, times=None, full_chords=None):
+    """
+    Decodes the take window by window and sends each window's /Pluck chunks as soon as
+    they are ready, so the first phrase starts while later windows are still decoding.
+    """
+    if times is None:
+        times = {}
+    start = time.time()
+    window_size = 32
+    prepared = ec2_generator.prepare_song_input(song_key, song_data, window_size=window_size, test_midi=midi_file_path, bpm=bpm,
+                                                 full_chords=full_chords, write_midi=False)
+    total_length = prepared[-1]
+    bpm_secs = 60 / bpm
+
+    # The end of the take is known before decoding: count-in plus every window
+    empty_chord = [list(item) for item in chords][-1]
+    empty_chord[0] = 'On'
+    empty_chord[1] = round(4 * bpm_secs + total_length / 4 * bpm_secs, 5)
+    empty_chord = [empty_chord]
+    empty_strum = [['UP', 0.0]]
+
+    t_play = None
+    num_chunks = 0
+    for index, chunk in ec2_generator.iter_pluck_chunks(prepared, window_size=window_size, bpm=bpm, cancel_event=cancel_event):
+        if t_play is None:
+            times["first_chunk"] = time.time()
+            t_record, overall_wait = time_to_next_beat(bpm_secs)
+            t_play = t_record + overall_wait
+            if not bundle:
+                wait_until(t_play - 0.35) # 0.35 is set latency
+            times["send_start"] = time.time()
+            if bundle:
+                for b in pack_bundles([("/Chords", empty_chord), ("/Strum", empty_strum)], t_play, MTU_MAX_PACKET_SIZE):
+                    client.send(b)
+            else:
+                client.send_message("/Chords", empty_chord)
+                client.send_message("/Strum", empty_strum)
+        if bundle:
+            for b in pack_bundles([("/Pluck", chunk)], t_play, MTU_MAX_PACKET_SIZE):
+                client.send(b)
+        else:
+            client.send_message("/Pluck", chunk)
+        times.setdefault("first_sent", time.time())
+        num_chunks += 1
+    end = time.time()
+    times["generated"] = times["sent"] = end
+    if t_play is None:
+        print("Nothing to send")
+        return
+    print(f"Sent {num_chunks} /Pluck chunks for {total_length // window_size} windows")
+    print(f"Time to first chunk: {times['first_chunk'] - start:.3f}s, total generation: {end - start:.3f}s")
+
+def time_to_next_beat(bpm_secs, beats=1):
+    """
+    Returns (t_record, overall_wait): now, and the seconds from now until Live's next beat
+    (or, with beats > 1, the next multiple of that many beats, e.g. a bar for a downbeat).
+    """
     global playing_position
     while(playing_position < 0.0):
         ableton_client.send_message("/live/song/get/current_song_time", [])
     print(f"Playing position: {playing_position}")
     t_record = time.time()
+    period = bpm_secs * beats
+    position_secs = playing_position * bpm_secs # Live reports the song time in beats
+    overall_wait = period - (position_secs % period) # time until next beat
+    return t_record, overall_wait
 
-
-    overall_wait = bpm_secs - (playing_position % bpm_secs) # time until next beat
-    send_t = t_record + overall_wait - 0.35 # 0.35 is set latency
+def wait_until(send_t):
     telapse = time.time()
     while(telapse - send_t <  0.01):
-        # print(telapse - send_t)
         time.sleep(0.005)
         telapse = time.time()
-    client.send_message("/Chords", empty_chord)
-    client.send_message("/Strum", empty_strum)
-    client.send_message("/Pluck", pluck_list)
-    print("Sent")
-    # .35 seconds of delay between sent message and it being played
 
-    
+def midi_to_GB_UDP_streaming(midi_file_path, bundle=None):
+    """
+    Streaming version of midi_to_GB_UDP (experimental, see streaming.py): follows the
+    MIDI file and sends each 2-bar window's /Pluck chunks to GuitarBot as soon as it is
+    decoded. The rows match send_plucks/send_progressive (count-in, metronome, speed
+    normalization, chained ontimes); the first window is aligned to the next beat. The
+    closing 'On' /Chords and the /Strum go out once the take is over and its end is known.
+    """
+    print("/" + "="*50 + "/")
+    print("midi_to_GB_UDP_streaming()")
+    print("/" + "="*50 + "/\n")
+
+    global last_take_times
+    times = {"file": midi_file_path, "start": time.time()}
+    last_take_times = times
+    song_key, melody_array, chord_array, song_data = ec2_generator.song_select('Grateful Dead - Uncle Johns Band.mid')
+    bpm, time_signature = live_state.snapshot()
+    bpm_secs = 60 / bpm
+    if bundle is None:
+        bundle = bundle_mode
+
+    def send(messages):
+        if bundle: # every message of the take shares the playback_start timetag
+            for b in pack_bundles(messages, times["playback_start"], MTU_MAX_PACKET_SIZE):
+                client.send(b)
+        else:
+            for address, args in messages:
+                client.send_message(address, args)
+
+    def send_window(index, prediction_window, chunks):
+        if len(chunks) == 0:
+            return
+        if "playback_start" not in times:
+            times["first_window"] = time.time()
+            t_record, overall_wait = time_to_next_beat(bpm_secs)
+            times["playback_start"] = t_record + overall_wait
+            if not bundle:
+                wait_until(times["playback_start"] - 0.35) # 0.35 is set latency
+            times["send_start"] = time.time()
+        send([("/Pluck", chunk) for chunk in chunks])
+        times.setdefault("first_sent", time.time())
+        times["sent"] = time.time()
+        print(f"Sent window {index + 1} ({len(chunks)} /Pluck chunks)")
+
+    session = StreamingEC2Session(ec2_generator, song_data, bpm=bpm, timesig=list(time_signature), on_window=send_window)
+    follow_midi_file(midi_file_path, session)
+    if "playback_start" not in times:
+        print("Nothing to send")
+        return
+    # same closing messages as send_plucks: the chord 'On' at the phrase end, then the strum
+    send([("/Chords", [['On', round(float(session.last_ontime), 5)]]), ("/Strum", [['UP', 0.0]])])
+    times["sent"] = time.time()
+    print(f"Time to first window: {times['first_window'] - times['start']:.3f}s, "
+          f"total: {times['sent'] - times['start']:.3f}s")
+
+def send_take(take):
+    """Send stage of the TakePipeline."""
+    global last_take_times
+    last_take_times = take["times"]
+    last_take_times["file"] = take["file"]
+    send_plucks(take["chords"], take["strum"], take["pluck_message"], take["bpm"], bundle_mode, times=take["times"])
+
+def start_take(midi_file_path):
+    """
+    Watcher callback: generates the take on its own thread so the watcher can see the
+    next file right away. A newer take from the same directory cancels this one at its
+    next window boundary (or before it is sent).
+    """
+    cancel_event = latest_wins.begin(midi_file_path)
+    if speculator is not None:
+        speculator.preempt() # real work first
+    def run():
+        try:
+            midi_to_GB_UDP(midi_file_path, cancel_event=cancel_event)
+        except GenerationCancelled as e:
+            print(f"{e}: {midi_file_path}")
+        finally:
+            latest_wins.end(midi_file_path, cancel_event)
+            if speculator is not None:
+                speculator.release()
+    threading.Thread(target=run, daemon=True).start()
+
+def start_streaming_take(midi_file_path):
+    """Watcher callback for streaming_mode: follows the new file on its own thread."""
+    threading.Thread(target=midi_to_GB_UDP_streaming, args=(midi_file_path,), daemon=True).start()
+
 def watch_NN_dir(input_directory):
     # watch_directory(input_directory, midi_to_liveosc) for ableton live testing
-    watch_directory(input_directory, midi_to_GB_UDP)
+    if streaming_mode:
+        watch_directory(input_directory, start_streaming_take)
+    elif pipeline_mode:
+        global take_pipeline
+        take_pipeline = TakePipeline(ec2_generator, send=send_take, get_bpm=lambda: live_state.snapshot()[0]).start()
+        watch_directory(input_directory, take_pipeline.submit)
+    else:
+        watch_directory(input_directory, start_take)
 
 def watch_Anti_dir(input_directory):
     watch_directory(input_directory, anti_to_liveosc)
@@ -92,9 +342,9 @@ def start_server(ip, port):
     dispatcher.map("/live/song/get/current_song_time", playing_position_handler)
     dispatcher.map("/live/error", print_error)
     dispatcher.map("/live/clip/get/playing_position", playing_position_handler)
-    server = osc_server.ThreadingOSCUDPServer((ip, port), dispatcher)
-    print("Serving on {}".format(server.server_address))
-    server.serve_forever()
+    live_state.attach(dispatcher)
+    # Replies are dispatched on the shared transport's event loop, not a thread per packet
+    return get_transport().serve(ip, port, dispatcher)
 
 def print_error(address, args):
     print("Received error from Live: %s" % args)
@@ -104,8 +354,11 @@ def playing_position_handler(address, *args):
     playing_position = args[0]  # assumes a single float value is sent
 
 midi_file_path = None
-model = None
-model_size = 'small'
+take_pipeline = None
+speculator = None # pre-generates likely next phrases while idle (not used with pipeline_mode or streaming_mode)
+model_size = 'small' # anticipation model size, shared through model_registry
+anticipation_mode = False # preload the anticipation model in the background at startup
+anticipation_memory_budget = DEFAULT_MEMORY_BUDGET # bytes of anticipation models kept resident (None: no limit)
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
@@ -132,8 +385,12 @@ if __name__ == "__main__":
         
     ec2_generator = EC2Generator(
         model_path='./icm-deep-music-generation/ec2vae/model_param/ec2vae-v1.pt',
-        pickle_path="./GP_Melody_Chords/ec2_with_UJB.pkl"
+        pickle_path="./GP_Melody_Chords/ec2_with_UJB.pkl",
+        cache=GenerationCache(max_entries=64), # repeated progressions in a looping jam skip generation
+        num_threads="auto" # fastest intra-op thread count on this machine, timed at startup
     )
+    if not pipeline_mode and not streaming_mode: # only start_take observes takes and pre-empts it
+        speculator = Speculator(ec2_generator, 'Grateful Dead - Uncle Johns Band.mid').start()
     directory = "./GP_Melody_Chords"
     pickle_filename = "vae_data.pkl"
     pickle_path = os.path.join(directory, pickle_filename)
@@ -142,27 +399,26 @@ if __name__ == "__main__":
     # print("Starting NeuralNote...")
     # open_neuralnote(neuralnote_path) # commented for vst use
 
-    # Load the model
-    # print("Loading model...")
-    # model = load_model(model_size)
-    # print(f"Model loaded: {model_size}")
+    # Load the anticipation model in the background; anti.py takes it from the registry once ready
+    model_registry.memory_budget = anticipation_memory_budget
+    if anticipation_mode:
+        model_registry.preload([model_size])
 
-    # Start the OSC server in a separate thread
+    # Start the OSC server on the shared asyncio transport
     server_ip = "127.0.0.1"
     server_port = 11001
-    server_thread = threading.Thread(target=start_server, args=(server_ip, server_port))
-    server_thread.daemon = True
-    server_thread.start()
+    start_server(server_ip, server_port)
 
     # Start the OSC client
     client_ip = "192.168.1.1"
     # client_ip = "127.0.0.1"
     client_port = 12000
-    client = udp_client.SimpleUDPClient(client_ip, client_port)
+    client = get_transport().client(client_ip, client_port)
 
     ableton_client_ip = "127.0.0.1"
     ableton_client_port = 11000
-    ableton_client = udp_client.SimpleUDPClient(ableton_client_ip, ableton_client_port)
+    ableton_client = get_transport().client(ableton_client_ip, ableton_client_port)
+    live_state.start_listening(ableton_client) # keeps live_state current while Live is running
 
     # Start watching the directory for new MIDI files in a separate thread
     NNWatcher_thread = threading.Thread(target=watch_NN_dir, args=(NN_dir,))
@@ -32,7 +32,7 @@ def map_speed(midi_value, min_midi=50, max_midi=68, speed_mode="direct", default
     else:
         return default_speed
 
-def rule_based_melody(full_chords, bpm=100, debug=True, speed_mode="direct"):
+def rule_based_melody(full_chords, bpm=100, debug=True, speed_mode="direct", write_midi=True):
     number_of_chords = len(full_chords)
     print("Number of chords:", number_of_chords)
     melody = stream.Stream()
@@ -117,6 +117,9 @@ def rule_based_melody(full_chords, bpm=100, debug=True, speed_mode="direct"):
 
         time_cursor += n.quarterLength * quarter_note_duration
 
+    if not write_midi:
+        # Callers that only need the pluck rows (e.g. melody_to_array) can skip the file round trip
+        return pluck_message, None
     file_path = "rule_based_melody.mid"
     melody.write("midi", file_path)
     return pluck_message, file_path
@@ -10,17 +10,22 @@ Provides a callable module to:
 
 import os
 import copy
+import contextlib
+from collections import deque
 import torch
+import torch.nn.functional as F
 import tqdm
 import pretty_midi
 from midi_utils import quantize_midi
 from CPT import TMIDIX
-from CPT.x_transformer_1_23_2 import TransformerWrapper, AutoregressiveWrapper, Decoder
+from CPT.x_transformer_1_23_2 import TransformerWrapper, AutoregressiveWrapper, Decoder, top_k
 from huggingface_hub import hf_hub_download
 
 # Global configuration – adjust these parameters as needed
-MODEL_PRECISION = 'float16'  # or "float16" if preferred
-DEVICE_TYPE = 'cuda'
+MODEL_PRECISION = 'float16'  # GPU autocast: "float16" or "bfloat16"
+CPU_PRECISION = 'float32'    # CPU: "float32" (no autocast) or "bfloat16"
+DEVICE_TYPE = 'cuda' if torch.cuda.is_available() else 'cpu'
+NUM_THREADS = None   # torch intra-op threads on CPU (None: torch's default)
 SEQ_LEN = 4096       # maximal sequence length
 PAD_IDX = 449        # model pad index
 DIM = 1024           # model dimension
@@ -31,21 +36,38 @@ MODELS_DIR = os.path.join("CPT", "Models", "Melody")
 
 # Global model
 model = None
+AUTOCAST_DTYPE = None  # set by setup_model; None runs in float32 without autocast
 
-def setup_model():
+def autocast_context():
+    """The autocast context chosen by setup_model for the current device."""
+    if AUTOCAST_DTYPE is None:
+        return contextlib.nullcontext()
+    return torch.amp.autocast(device_type=DEVICE_TYPE, dtype=AUTOCAST_DTYPE)
+
+def setup_model(device_type=None, precision=None, num_threads=None):
     """
     Sets up and loads the pre-trained model.
     Returns the model and the torch.autocast context.
+
+    device_type defaults to DEVICE_TYPE ('cuda' when available, else 'cpu'). precision
+    defaults to MODEL_PRECISION on the GPU and CPU_PRECISION on the CPU; num_threads
+    (or NUM_THREADS) sets torch's intra-op thread count on the CPU.
     """
-    global model
+    global model, DEVICE_TYPE, AUTOCAST_DTYPE
+    DEVICE_TYPE = device_type or DEVICE_TYPE
+    num_threads = num_threads or NUM_THREADS
     # Choose dtypes based on precision
-    if MODEL_PRECISION == 'bfloat16' and torch.cuda.is_bf16_supported():
-        dtype_str = 'bfloat16'
+    if DEVICE_TYPE == 'cuda':
+        precision = precision or MODEL_PRECISION
+        dtype_str = 'bfloat16' if precision == 'bfloat16' and torch.cuda.is_bf16_supported() else 'float16'
     else:
-        dtype_str = 'float16'
-    ptdtype = {'bfloat16': torch.bfloat16, 'float16': torch.float16}[dtype_str]
+        precision = precision or CPU_PRECISION
+        dtype_str = 'bfloat16' if precision == 'bfloat16' else 'float32'
+        if num_threads:
+            torch.set_num_threads(num_threads)
+    AUTOCAST_DTYPE = {'bfloat16': torch.bfloat16, 'float16': torch.float16, 'float32': None}[dtype_str]
     
-    ctx = torch.amp.autocast(device_type=DEVICE_TYPE, dtype=ptdtype)
+    ctx = autocast_context()
 
     model_path = os.path.join(MODELS_DIR, MODEL_CHECKPOINT_FILE)
 
@@ -66,7 +88,7 @@ def setup_model():
         attn_layers=Decoder(dim=DIM, depth=DEPTH, heads=HEADS, attn_flash=True)
     )
     model_instance = AutoregressiveWrapper(model_instance, ignore_index=PAD_IDX, pad_value=PAD_IDX)
-    model_instance = model_instance.cuda()
+    model_instance = model_instance.to(DEVICE_TYPE)
     
     # Construct the model path
     model_path = os.path.join(MODELS_DIR, MODEL_CHECKPOINT_FILE)
@@ -74,45 +96,18 @@ def setup_model():
         raise FileNotFoundError(f"Model checkpoint not found at {model_path}")
     
     # Load state dict and prepare eval mode
-    model_instance.load_state_dict(torch.load(model_path))
+    model_instance.load_state_dict(torch.load(model_path, map_location=DEVICE_TYPE))
     model_instance.eval()
 
     model = model_instance
-    print("Model loaded with", dtype_str, "precision.")
+    print("Model loaded on", DEVICE_TYPE, "with", dtype_str, "precision.")
     return model, ctx
 
-def generate_melody(seed_midi_path, output_dir='./generated', temperature=0.75,
-                    max_melody_notes_per_chord=12, number_of_chords_to_generate=128):
+def chords_to_tokens(cscore):
     """
-    Generates a melody from a seed MIDI file.
-    
-    Process:
-      1. Reads the seed MIDI and converts it to a single track millisecond score using TMIDIX.
-      2. Processes the score (advanced score processing, chordify) to obtain chord tokens.
-      3. Runs the generation loop using the global model.
-      4. Converts the resulting score (ms_SONG format) to a MIDI file via Tegridy_ms_SONG_to_MIDI_Converter.
-      5. Returns the file path of the full composition MIDI.
+    Turns a chordified score into the per-chord token groups the model is primed with
+    (chord token + 128, each group starting with the previous chord).
     """
-    # Ensure output directory exists
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Read seed MIDI file in binary mode and convert to ms score:
-    with open(seed_midi_path, 'rb') as f:
-        seed_data = f.read()
-    raw_score = TMIDIX.midi2single_track_ms_score(seed_data)
-    
-    # Process the score: you can use advanced_score_processor to get an "enhanced" score.
-    raw_escore = TMIDIX.advanced_score_processor(raw_score, return_enhanced_score_notes=True)[0]
-    # Remove percussion channel events (channel index 9)
-    raw_escore = [e for e in raw_escore if e[3] != 9]
-    
-    # Augment the enhanced score (this might include adding extra attributes)
-    escore = TMIDIX.augment_enhanced_score_notes(raw_escore)
-    
-    # Chordify the score (wrap into an ms SONG object)
-    cscore = TMIDIX.chordify_score([1000, escore])
-    
-    # Create chord tokens list (this snippet mimics the notebook process)
     chords_tokens = []
     cho_toks = []
     for c in cscore:
@@ -129,8 +124,75 @@ def generate_melody(seed_midi_path, output_dir='./generated', temperature=0.75,
             cho_toks = [cho_toks[-1]]
     cho_toks = cho_toks + cho_toks  # duplicate final token
     chords_tokens.append(cho_toks)
+    return chords_tokens
+
+def seed_chords_tokens(seed_midi_path):
+    """Reads a seed MIDI file and returns its chord token groups (see chords_to_tokens)."""
+    # Read seed MIDI file in binary mode and convert to ms score:
+    with open(seed_midi_path, 'rb') as f:
+        seed_data = f.read()
+    raw_score = TMIDIX.midi2single_track_ms_score(seed_data)
     
-    # Generation: extend a token list using the model.
+    # Process the score: you can use advanced_score_processor to get an "enhanced" score.
+    raw_escore = TMIDIX.advanced_score_processor(raw_score, return_enhanced_score_notes=True)[0]
+    # Remove percussion channel events (channel index 9)
+    raw_escore = [e for e in raw_escore if e[3] != 9]
+    
+    # Augment the enhanced score (this might include adding extra attributes)
+    escore = TMIDIX.augment_enhanced_score_notes(raw_escore)
+    
+    # Chordify the score (wrap into an ms SONG object)
+    cscore = TMIDIX.chordify_score([1000, escore])
+    
+    return chords_to_tokens(cscore)
+
+class IncrementalDecoder:
+    """
+    Feeds tokens to the model one position at a time and keeps the attention key/value
+    cache between steps, so each new token only attends over the cached prefix instead
+    of re-encoding it. Every row of the batch advances by one token per step, so all
+    rows share one cache. logits holds the next-token logits after the last step.
+    """
+    def __init__(self, model, batch_size=1, max_seq_len=SEQ_LEN):
+        self.net = model.net
+        self.max_seq_len = max_seq_len
+        device = next(self.net.parameters()).device
+        self.tokens = torch.full((batch_size, max_seq_len), PAD_IDX, dtype=torch.long, device=device)
+        self.length = 0
+        self.cache = None
+        self.logits = None
+
+    def step(self, column):
+        """Appends one token per row (a list of batch_size ints) and runs the newest position."""
+        if self.length == self.max_seq_len:
+            self._shrink()
+        self.tokens[:, self.length] = torch.as_tensor(column, dtype=torch.long, device=self.tokens.device)
+        self.length += 1
+        # The wrapper only runs the last position when given a cache
+        logits, self.cache = self.net(self.tokens[:, :self.length], return_intermediates=True, cache=self.cache)
+        self.logits = logits[:, -1]
+
+    def feed(self, tokens):
+        """Appends the same tokens to every row."""
+        for token in tokens:
+            self.step([token] * self.tokens.shape[0])
+
+    def _shrink(self):
+        """Keeps the newest half of the sequence and rebuilds the cache from it in one pass."""
+        keep = self.max_seq_len // 2
+        self.tokens[:, :keep] = self.tokens[:, self.length - keep:self.length].clone()
+        self.length = keep
+        logits, self.cache = self.net(self.tokens[:, :keep], return_intermediates=True)
+        self.logits = logits[:, -1]
+
+    def sample(self, temperature=0.75):
+        """Samples one token per row from the current logits."""
+        # Same filtering and sampling as AutoregressiveWrapper.generate's defaults
+        probs = F.softmax(top_k(self.logits.float()) / temperature, dim=-1)
+        return torch.multinomial(probs, 1)[:, 0].tolist()
+
+def _generate_tokens_full(chords_tokens, temperature, max_melody_notes_per_chord, number_of_chords_to_generate):
+    """Original loop: one model.generate call per token over the whole prefix."""
     output_tokens = []
     for i in tqdm.tqdm(range(min(len(chords_tokens), number_of_chords_to_generate))):
         try:
@@ -139,9 +201,9 @@ def generate_melody(seed_midi_path, output_dir='./generated', temperature=0.75,
             count = 0
             # Generate up to max melody notes per chord
             while o < 128 and count < max_melody_notes_per_chord:
-                x = torch.LongTensor([[output_tokens]]).cuda()
+                x = torch.LongTensor([[output_tokens]]).to(DEVICE_TYPE)
                 # Use the autocast context from setup_model
-                with torch.amp.autocast(device_type=DEVICE_TYPE, dtype=torch.float16):
+                with autocast_context():
                     out = model.generate(x[-number_of_chords_to_generate:], 1,
                                          temperature=temperature,
                                          return_prime=False,
@@ -153,28 +215,126 @@ def generate_melody(seed_midi_path, output_dir='./generated', temperature=0.75,
         except Exception as e:
             print("Generation error:", e)
             break
+    return output_tokens
+
+def _generate_tokens_cached(chords_tokens, temperature, max_melody_notes_per_chord, number_of_chords_to_generate):
+    """Incremental loop: chord tokens and accepted melody tokens are fed once through an IncrementalDecoder."""
+    output_tokens = []
+    decoder = IncrementalDecoder(model)
+    with torch.no_grad(), autocast_context():
+        for i in tqdm.tqdm(range(min(len(chords_tokens), number_of_chords_to_generate))):
+            try:
+                output_tokens.extend(chords_tokens[i])
+                decoder.feed(chords_tokens[i])
+                count = 0
+                # Generate up to max melody notes per chord; a chord token (>= 128) ends the chord
+                # and is dropped, as in the original loop
+                while count < max_melody_notes_per_chord:
+                    o = decoder.sample(temperature)[0]
+                    if o >= 128:
+                        break
+                    output_tokens.append(o)
+                    decoder.feed([o])
+                    count += 1
+            except Exception as e:
+                print("Generation error:", e)
+                break
+    return output_tokens
 
+def generate_tokens(chords_tokens, temperature=0.75, max_melody_notes_per_chord=12,
+                    number_of_chords_to_generate=128, use_kv_cache=True):
+    """
+    Extends the chord token groups with generated melody tokens (< 128) and returns
+    the full token list. Uses the key/value cached loop unless use_kv_cache is False
+    or the model can't cache.
+    """
+    if use_kv_cache and getattr(model.net, 'can_cache_kv', False):
+        return _generate_tokens_cached(chords_tokens, temperature, max_melody_notes_per_chord, number_of_chords_to_generate)
+    return _generate_tokens_full(chords_tokens, temperature, max_melody_notes_per_chord, number_of_chords_to_generate)
+
+def generate_token_batch(chords_tokens, num_sequences, temperature=0.75, max_melody_notes_per_chord=12,
+                         number_of_chords_to_generate=128):
+    """
+    Generates num_sequences independent token lists for the same chords as one batch.
+
+    Rows stop early per chord on their own, like generate_tokens, but every row still
+    appends exactly one token per step (a sampled melody token or its next pending
+    chord token), so all rows stay the same length and share one key/value cache.
+    Finished rows append padding until the last row is done.
+    """
+    num_chords = min(len(chords_tokens), number_of_chords_to_generate)
+    outputs = [[] for _ in range(num_sequences)]
+    pending = [deque(chords_tokens[0]) for _ in range(num_sequences)]
+    chord = [0] * num_sequences
+    count = [0] * num_sequences
+    done = [False] * num_sequences
+
+    def next_chord(i):
+        chord[i] += 1
+        count[i] = 0
+        if chord[i] < num_chords:
+            pending[i].extend(chords_tokens[chord[i]])
+        else:
+            done[i] = True
+
+    decoder = IncrementalDecoder(model, batch_size=num_sequences)
+    with torch.no_grad(), autocast_context():
+        while True:
+            samples = decoder.sample(temperature) if decoder.logits is not None else None
+            column = []
+            for i in range(num_sequences):
+                if not done[i] and not pending[i]:
+                    if count[i] < max_melody_notes_per_chord and samples[i] < 128:
+                        outputs[i].append(samples[i])
+                        count[i] += 1
+                        column.append(samples[i])
+                        continue
+                    # A sampled chord token or a full chord ends the chord; the token is dropped
+                    next_chord(i)
+                if pending[i]:
+                    column.append(pending[i].popleft())
+                    outputs[i].append(column[-1])
+                else:
+                    column.append(PAD_IDX)
+            if all(done):
+                break
+            decoder.step(column)
+    return outputs
+
+def write_composition(chords_tokens, output_tokens, output_base):
+    """
+    Renders generated tokens as chords (channel 0) plus the melody generated over each
+    chord group (channel 3) and writes output_base + '.mid'.
+    """
     # Build a full ms SONG from the generated tokens.
     song_f = []
     time_cursor = 0
     dur = 32    # you can adjust duration
     vel = 90
-    # For each group in the generated tokens list, assemble chord and melody notes.
+    position = 0
+    # For each chord group in the generated tokens list, assemble chord and melody notes.
     for group in chords_tokens:
+        if position >= len(output_tokens):
+            break
+        position += len(group)
+        melody = []
+        while position < len(output_tokens) and output_tokens[position] < 128:
+            melody.append(output_tokens[position])
+            position += 1
         chord_index = group[0] - 128
         tones_chord = TMIDIX.ALL_CHORDS_SORTED[chord_index]
         # Add chord events
         for t in tones_chord:
             song_f.append(['note', time_cursor * 16, dur * 16, 0, 60 + t, vel, 0])
             song_f.append(['note', time_cursor * 16, dur * 16, 0, 48 + t, vel, 0])
-        ptc_count = len(group)
-        ptc_time_dur = dur // (ptc_count if ptc_count > 0 else 1)
-        for p in group:
+        if not melody:
+            time_cursor += dur
+            continue
+        ptc_time_dur = dur // len(melody)
+        for p in melody:
             song_f.append(['note', time_cursor * 16, ptc_time_dur * 16, 3, p, vel, 40])
             time_cursor += ptc_time_dur
 
-    # Define output file base (without extension)
-    output_base = os.path.join(output_dir, "Seed-Composition")
     print("Converting to MIDI. Please stand-by...")
     detailed_stats = TMIDIX.Tegridy_ms_SONG_to_MIDI_Converter(
                         song_f,
@@ -186,6 +346,34 @@ def generate_melody(seed_midi_path, output_dir='./generated', temperature=0.75,
     print("Composition MIDI saved as:", output_base + ".mid")
     return output_base + ".mid"
 
+def generate_melody(seed_midi_path, output_dir='./generated', temperature=0.75,
+                    max_melody_notes_per_chord=12, number_of_chords_to_generate=128, use_kv_cache=True):
+    """
+    Generates a melody from a seed MIDI file.
+    
+    Process:
+      1. Reads the seed MIDI and converts it to a single track millisecond score using TMIDIX.
+      2. Processes the score (advanced score processing, chordify) to obtain chord tokens.
+      3. Runs the generation loop using the global model (incrementally with a key/value
+         cache when use_kv_cache is set and the model supports it).
+      4. Converts the resulting score (ms_SONG format) to a MIDI file via Tegridy_ms_SONG_to_MIDI_Converter.
+      5. Returns the file path of the full composition MIDI.
+    """
+    # Ensure output directory exists
+    os.makedirs(output_dir, exist_ok=True)
+    
+    chords_tokens = seed_chords_tokens(seed_midi_path)
+
+    # Generation: extend a token list using the model.
+    output_tokens = generate_tokens(chords_tokens, temperature=temperature,
+                                    max_melody_notes_per_chord=max_melody_notes_per_chord,
+                                    number_of_chords_to_generate=number_of_chords_to_generate,
+                                    use_kv_cache=use_kv_cache)
+
+    # Define output file base (without extension)
+    output_base = os.path.join(output_dir, "Seed-Composition")
+    return write_composition(chords_tokens, output_tokens, output_base)
+
 def extract_melody(midi_file_path, output_dir='./generated', melody_patch=40, melody_channel=3):
     """
     Uses pretty_midi to extract only the melody channel from a given MIDI file.
@@ -281,7 +469,7 @@ def limit_note_range(midi_file_path, output_dir='./generated', new_name=None):
     pm.write(adjusted_path)
     print("Adjusted MIDI saved as:", adjusted_path)
     return adjusted_path
-def generate_melody_variations(seed_melody_path, variations=3, output_dir='./generated', **gen_kwargs):
+def generate_melody_variations(seed_melody_path, variations=3, output_dir='./generated', batched=False, **gen_kwargs):
     """
     Uses a given seed MIDI file (for example, a previously generated melody)
     to generate multiple new composition files.
@@ -290,12 +478,28 @@ def generate_melody_variations(seed_melody_path, variations=3, output_dir='./gen
       seed_melody_path (str): MIDI file to use as the seed.
       variations (int): Number of new files to generate.
       output_dir (str): Directory where generated files will be stored.
-      **gen_kwargs: Additional keyword arguments to pass to generate_melody.
+      batched (bool): Decode all variations as one batch (generate_token_batch) instead
+                      of calling generate_melody once per variation.
+      **gen_kwargs: Additional keyword arguments to pass to generate_melody
+                    (temperature, max_melody_notes_per_chord, number_of_chords_to_generate
+                    in batched mode).
     
     Returns:
       list: List of file paths for the generated composition MIDI files.
     """
     variation_paths = []
+    if batched:
+        print(f"Generating {variations} variations as one batch using seed {seed_melody_path}...")
+        gen_kwargs.pop('use_kv_cache', None)
+        chords_tokens = seed_chords_tokens(seed_melody_path)
+        outputs = generate_token_batch(chords_tokens, variations, **gen_kwargs)
+        for i, output_tokens in enumerate(outputs):
+            var_output_base = os.path.join(output_dir, "Seed-Composition_variation_" + str(i+1))
+            os.makedirs(var_output_base, exist_ok=True)
+            composition_path = write_composition(chords_tokens, output_tokens, os.path.join(var_output_base, "Seed-Composition"))
+            composition_path = limit_note_range(composition_path, output_dir=var_output_base)
+            variation_paths.append(composition_path)
+        return variation_paths
     # Loop to generate the specified number of variations.
     for i in range(variations):
         var_output_base = os.path.join(output_dir, "Seed-Composition_variation_" + str(i+1))
@@ -305,7 +509,7 @@ def generate_melody_variations(seed_melody_path, variations=3, output_dir='./gen
         composition_path = generate_melody(seed_melody_path, output_dir=var_output_base, **gen_kwargs)
         
         # Optionally, you can also adjust the note range of this new composition:
-        composition_path = limit_note_range(composition_path)
+        composition_path = limit_note_range(composition_path, output_dir=var_output_base)
         variation_paths.append(composition_path)
     return variation_paths
 if __name__ == "__main__":
@@ -333,6 +537,6 @@ if __name__ == "__main__":
     # Use the generated melody (or the limited version) as a new seed
     # for generating three new variations.
     print("Generating melody variations using the extracted melody as seed...")
-    variations = generate_melody_variations(limited_midi, variations=3)
+    variations = generate_melody_variations(limited_midi, variations=3, batched=True)
     for idx, var in enumerate(variations):
         print(f"Variation {idx+1} MIDI stored at: {var}")
\ No newline at end of file
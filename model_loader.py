@@ -1,3 +1,4 @@
+import threading
 import time
 from transformers import AutoModelForCausalLM
 from torch.cuda import is_available
@@ -6,29 +7,196 @@ SMALL_MODEL = 'stanford-crfm/music-small-800k'     # faster inference, worse sam
 MEDIUM_MODEL = 'stanford-crfm/music-medium-800k'   # slower inference, better sample quality
 LARGE_MODEL = 'stanford-crfm/music-large-800k'     # slowest inference, best sample quality
 
-def load_model(model_size='large'):
+MODEL_MAP = {
+    'small': SMALL_MODEL,
+    'medium': MEDIUM_MODEL,
+    'large': LARGE_MODEL
+}
+
+# Approximate float32 parameter bytes per size (128M/360M/780M parameters), used to make
+# room before a size has been loaded once; after that its measured size is used
+MODEL_BYTES = {
+    'small': 128 * 10**6 * 4,
+    'medium': 360 * 10**6 * 4,
+    'large': 780 * 10**6 * 4
+}
+
+DEFAULT_MEMORY_BUDGET = 4 * 2**30 # large and small together, not all three
+
+def check_size(model_size):
+    """Raises ValueError for anything but 'small', 'medium' or 'large'."""
+    if model_size not in MODEL_MAP:
+        raise ValueError(f"Unknown anticipation model size '{model_size}', expected one of {list(MODEL_MAP)}")
+
+def load_model(model_size='small', local_files_only=False):
     """
     Load the anticipatory music transformer model.
 
     :param model_size: Size of the model to load. Options are 'small', 'medium', 'large'.
+    :param local_files_only: Only load from the local Hugging Face cache (no download).
     :return: Loaded model.
     """
-    model_map = {
-        'small': SMALL_MODEL,
-        'medium': MEDIUM_MODEL,
-        'large': LARGE_MODEL
-    }
-
-    model_name = model_map.get(model_size, LARGE_MODEL)
+    check_size(model_size)
+    model_name = MODEL_MAP[model_size]
 
     start = time.time()
     if is_available():
         print("CUDA is available. Using GPU.")
-        model = AutoModelForCausalLM.from_pretrained(model_name).cuda()
+        model = AutoModelForCausalLM.from_pretrained(model_name, local_files_only=local_files_only).cuda()
     else:
         print("CUDA is not available. Using CPU.")
-        model = AutoModelForCausalLM.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name, local_files_only=local_files_only)
+    model.eval()
     end = time.time()
 
     print(f"Model '{model_name}' loaded in {end - start} seconds")
-    return model
\ No newline at end of file
+    return model
+
+def resident_bytes(model):
+    """Bytes held by a model's parameters and buffers."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+class ModelRegistry:
+    """
+    One shared instance per anticipation model size for the whole process.
+
+    preload() loads sizes in a background thread (from the local cache, downloading
+    only if a size isn't cached yet) so startup doesn't block on from_pretrained.
+    get() hands out the shared instance, waiting for or starting its load if needed.
+    Before a load that would exceed memory_budget bytes (None for no limit), the least
+    recently used other sizes are evicted; callers still holding an evicted model keep
+    it working. Sizes are estimated from MODEL_BYTES until they have been loaded once.
+
+    Example:
+        registry.preload(['small', 'large'])
+        model = registry.get('small')            # blocks until ready
+        model = registry.get('large', wait=False) # None while still loading
+        registry.print_stats()
+    """
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, local_files_only=True):
+        self.memory_budget = memory_budget
+        self.local_files_only = local_files_only
+        self.models = {}   # size -> model
+        self.loading = {}  # size -> threading.Event set when its load finishes
+        self.errors = {}   # size -> exception of the last failed load
+        self.stats = {}    # size -> {"load_seconds", "resident_bytes", "hits", "last_used"}
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def preload(self, sizes=('small',)):
+        """Starts loading sizes on a background thread, one after another. Returns the thread."""
+        for size in sizes:
+            check_size(size)
+        sizes = [size for size in sizes if self._claim_load(size)]
+        thread = threading.Thread(target=lambda: [self._load(size) for size in sizes], daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, size='small', wait=True, timeout=None):
+        """
+        The shared model of this size. Loads it on the calling thread if nobody has
+        started to. With wait=False, returns None while it is still loading.
+        """
+        check_size(size)
+        with self._lock:
+            model = self.models.get(size)
+            if model is not None:
+                self._touch(size)
+                return model
+            claimed = self._claim_load(size)
+            ready = self.loading[size]
+        if claimed:
+            if not wait:
+                threading.Thread(target=self._load, args=(size,), daemon=True).start()
+                return None
+            self._load(size)
+        elif not wait or not ready.wait(timeout):
+            return None
+        with self._lock:
+            if size in self.errors:
+                raise self.errors[size]
+            model = self.models.get(size)
+            if model is not None:
+                self._touch(size)
+            return model
+
+    def is_ready(self, size):
+        with self._lock:
+            return size in self.models
+
+    def evict(self, size):
+        """Drops the registry's reference to a size."""
+        with self._lock:
+            if self.models.pop(size, None) is not None:
+                self.loading.pop(size, None)
+                self.evictions += 1
+                print(f"Evicted anticipation model '{size}'")
+
+    def resident_total(self):
+        with self._lock:
+            return sum(self.stats[size]["resident_bytes"] for size in self.models)
+
+    def print_stats(self):
+        with self._lock:
+            for size, s in self.stats.items():
+                state = "resident" if size in self.models else "evicted"
+                print(f"{size:<7} {state:<9} load {s['load_seconds']:.2f}s  "
+                      f"{s['resident_bytes'] / 2**20:.0f} MiB  hits {s['hits']}")
+            print(f"Resident total: {self.resident_total() / 2**20:.0f} MiB, evictions: {self.evictions}")
+
+    def _claim_load(self, size):
+        """True if the caller should load size (it is neither loaded nor loading)."""
+        with self._lock:
+            if size in self.models or size in self.loading:
+                return False
+            self.errors.pop(size, None)
+            self.loading[size] = threading.Event()
+            return True
+
+    def _touch(self, size):
+        self.stats[size]["hits"] += 1
+        self.stats[size]["last_used"] = time.time()
+
+    def expected_bytes(self, size):
+        """Measured resident bytes of a size if it was loaded before, else its MODEL_BYTES estimate."""
+        with self._lock:
+            if size in self.stats:
+                return self.stats[size]["resident_bytes"]
+            return MODEL_BYTES[size]
+
+    def _load(self, size):
+        ready = self.loading[size]
+        try:
+            with self._lock:
+                self._make_room(size, self.expected_bytes(size)) # free memory before from_pretrained allocates
+            start = time.time()
+            try:
+                model = load_model(size, local_files_only=self.local_files_only)
+            except OSError:
+                print(f"Anticipation model '{size}' is not in the local cache. Downloading...")
+                model = load_model(size)
+            load_seconds = time.time() - start
+            size_bytes = resident_bytes(model)
+            with self._lock:
+                self.models[size] = model
+                self.stats[size] = {"load_seconds": load_seconds, "resident_bytes": size_bytes,
+                                    "hits": 0, "last_used": time.time()}
+        except Exception as e:
+            print(f"Failed to load anticipation model '{size}': {e}")
+            with self._lock:
+                self.errors[size] = e
+                self.loading.pop(size, None)
+        finally:
+            ready.set()
+
+    def _make_room(self, size, size_bytes):
+        """Evicts the least recently used other sizes until size_bytes fits the budget."""
+        if self.memory_budget is None:
+            return
+        idle = sorted((s for s in self.models if s != size), key=lambda s: self.stats[s]["last_used"])
+        while idle and self.resident_total() + size_bytes > self.memory_budget:
+            self.evict(idle.pop(0))
+
+# Process-wide registry shared by anti.py and main.py
+registry = ModelRegistry()
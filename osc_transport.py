@@ -0,0 +1,172 @@
+# osc_transport.py
+"""
+One asyncio-based OSC transport shared by every sender and receiver.
+
+The event loop runs in a single daemon thread. It owns one persistent UDP socket
+per destination, a bounded send queue and any number of AsyncIOOSCUDPServer
+endpoints for replies (e.g. from Live). Incoming datagrams are dispatched on the
+loop itself, so a high rate of song-time updates no longer costs a thread spawn
+per packet the way ThreadingOSCUDPServer does.
+
+Senders keep the SimpleUDPClient interface:
+    client = get_transport().client("127.0.0.1", 11000)
+    client.send_message("/live/song/get/tempo", [])
+"""
+
+import asyncio
+import threading
+from collections.abc import Iterable
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_server import AsyncIOOSCUDPServer
+
+# AbletonOSC listens here
+ABLETON_IP = "127.0.0.1"
+ABLETON_PORT = 11000
+
+class TransportClient:
+    def __init__(self, transport, ip, port):
+        """
+        Drop-in replacement for udp_client.SimpleUDPClient that sends through a
+        shared OSCTransport instead of its own blocking socket.
+        """
+        self.transport = transport
+        self.address = (ip, port)
+
+    def send(self, content):
+        """Queues an OscMessage or OscBundle for sending."""
+        self.transport.send(self.address, content.dgram)
+
+    def send_message(self, address, value):
+        """Builds an OscMessage from address and value(s) and queues it, like SimpleUDPClient."""
+        builder = OscMessageBuilder(address=address)
+        if value is None:
+            pass
+        elif not isinstance(value, Iterable) or isinstance(value, (str, bytes)):
+            builder.add_arg(value)
+        else:
+            for val in value:
+                builder.add_arg(val)
+        self.send(builder.build())
+
+class OSCTransport:
+    def __init__(self, queue_size=256):
+        """
+        Args:
+            queue_size: Maximum number of datagrams waiting to be sent. When the queue
+                        is full, send() blocks the calling thread until there is room.
+        """
+        self.queue_size = queue_size
+        self.loop = asyncio.new_event_loop()
+        self.stats = {"sent": 0, "bytes": 0, "dropped": 0, "max_queue_depth": 0}
+        self._queue = None
+        self._sender_task = None
+        self._endpoints = {} # (ip, port) -> asyncio DatagramTransport
+        self._servers = []
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Starts the event loop thread. Returns self so it can be chained."""
+        if not self._thread.is_alive():
+            self._thread.start()
+            self._ready.wait()
+        return self
+
+    def stop(self):
+        """Closes every socket and stops the event loop."""
+        if not self._thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._sender_task = self.loop.create_task(self._sender())
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    async def _close(self):
+        self._sender_task.cancel()
+        for endpoint in self._endpoints.values():
+            endpoint.close()
+        for server in self._servers:
+            server.close()
+        self._endpoints = {}
+        self._servers = []
+
+    async def _endpoint(self, address):
+        """Returns the persistent socket for address, creating it on first use."""
+        endpoint = self._endpoints.get(address)
+        if endpoint is None or endpoint.is_closing():
+            endpoint, _ = await self.loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=address)
+            self._endpoints[address] = endpoint
+        return endpoint
+
+    async def _sender(self):
+        while True:
+            address, dgram = await self._queue.get()
+            try:
+                endpoint = await self._endpoint(address)
+                endpoint.sendto(dgram)
+                self.stats["sent"] += 1
+                self.stats["bytes"] += len(dgram)
+            except OSError as e:
+                self.stats["dropped"] += 1
+                print(f"OSC send to {address} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def send(self, address, dgram, timeout=None):
+        """
+        Queues a datagram for address. From other threads this blocks while the
+        queue is full (backpressure). On the loop thread itself (e.g. inside a
+        dispatcher handler) blocking would deadlock, so the datagram is dropped instead.
+        """
+        self.start()
+        if threading.current_thread() is self._thread:
+            try:
+                self._queue.put_nowait((address, dgram))
+            except asyncio.QueueFull:
+                self.stats["dropped"] += 1
+                return
+        else:
+            asyncio.run_coroutine_threadsafe(self._queue.put((address, dgram)), self.loop).result(timeout)
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self._queue.qsize())
+
+    async def send_async(self, address, dgram):
+        """Coroutine version of send() for code already running on the loop."""
+        await self._queue.put((address, dgram))
+
+    def flush(self, timeout=None):
+        """Blocks until every queued datagram has been handed to the OS."""
+        self.start()
+        asyncio.run_coroutine_threadsafe(self._queue.join(), self.loop).result(timeout)
+
+    def client(self, ip, port):
+        """Returns a SimpleUDPClient-compatible client for ip:port."""
+        return TransportClient(self, ip, port)
+
+    def serve(self, ip, port, dispatcher):
+        """
+        Starts an asyncio OSC server on ip:port that dispatches on the transport's loop.
+        Returns once the socket is bound.
+        """
+        self.start()
+        server = AsyncIOOSCUDPServer((ip, port), dispatcher, self.loop)
+        endpoint, _ = asyncio.run_coroutine_threadsafe(server.create_serve_endpoint(), self.loop).result()
+        self._servers.append(endpoint)
+        print("Serving on {}".format(endpoint.get_extra_info("sockname")))
+        return endpoint
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+    """Returns the process-wide OSCTransport, starting it on first use."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = OSCTransport().start()
+    return _transport
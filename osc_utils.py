@@ -0,0 +1,169 @@
+# osc_utils.py
+"""
+Helpers for sizing and packing OSC messages before they go out over UDP.
+
+Sizes follow the encoding python-osc uses: strings are null terminated and padded
+to 4 bytes, ints and floats take 4 bytes, bools/None take none and lists become
+'[' ... ']' arrays in the type tag.
+"""
+
+import numpy as np
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_bundle_builder import OscBundleBuilder
+
+# macOS caps UDP datagrams at 9216 bytes by default, so keep localhost traffic
+# (e.g. to Ableton Live) comfortably below that.
+LOCALHOST_MAX_PACKET_SIZE = 8192
+# 1500 byte Ethernet MTU - 20 byte IPv4 header - 8 byte UDP header.
+MTU_MAX_PACKET_SIZE = 1472
+
+def padded_size(num_bytes):
+    """Rounds num_bytes up to the next multiple of 4."""
+    return (num_bytes + 3) & ~3
+
+def osc_string_size(value):
+    """Encoded size of an OSC string, including the null terminator and padding."""
+    return padded_size(len(value.encode("utf-8")) + 1)
+
+def osc_arg_size(value):
+    """
+    Returns (type tag length, payload bytes) for a single OSC argument.
+    """
+    if isinstance(value, bool) or value is None:
+        return 1, 0
+    if isinstance(value, int):
+        return 1, 4 if -2**31 <= value < 2**31 else 8
+    if isinstance(value, float):
+        return 1, 4
+    if isinstance(value, str):
+        return 1, osc_string_size(value)
+    if isinstance(value, bytes):
+        return 1, 4 + padded_size(len(value))
+    if isinstance(value, (list, tuple)):
+        tags, payload = 2, 0
+        for item in value:
+            item_tags, item_payload = osc_arg_size(item)
+            tags += item_tags
+            payload += item_payload
+        return tags, payload
+    raise ValueError(f"Unsupported OSC argument type: {type(value)}")
+
+def osc_message_size(address, args):
+    """Encoded size in bytes of an OSC message with the given address and arguments."""
+    tags, payload = osc_arg_size(list(args))
+    # The outer list is the message itself, not an array, so drop its brackets
+    # and add the leading ',' of the type tag string.
+    return osc_string_size(address) + padded_size(tags - 2 + 1 + 1) + payload
+
+def pack_args(address, prefix_args, groups, max_packet_size=LOCALHOST_MAX_PACKET_SIZE):
+    """
+    Greedily packs argument groups into as few messages as fit under max_packet_size.
+
+    Each message is prefix_args followed by the flattened groups, e.g. AbletonOSC's
+    /live/clip/add/notes takes [track, clip] followed by repeated note groups.
+
+    :param address: OSC address of every message.
+    :param prefix_args: Arguments repeated at the start of every message.
+    :param groups: List of argument lists that must not be split across messages.
+    :param max_packet_size: Maximum encoded size of a single message in bytes.
+    :return: List of argument lists, one per message.
+    """
+    base_tags, base_payload = osc_arg_size(list(prefix_args))
+    base_tags = base_tags - 2 + 1  # drop the array brackets, add ','
+    address_size = osc_string_size(address)
+
+    messages = []
+    current = list(prefix_args)
+    tags, payload, count = base_tags, base_payload, 0
+    for group in groups:
+        group_tags, group_payload = osc_arg_size(list(group))
+        group_tags -= 2  # groups are flattened, not sent as arrays
+        size = address_size + padded_size(tags + group_tags + 1) + payload + group_payload
+        if count > 0 and size > max_packet_size:
+            messages.append(current)
+            current = list(prefix_args)
+            tags, payload, count = base_tags, base_payload, 0
+        current.extend(group)
+        tags += group_tags
+        payload += group_payload
+        count += 1
+    if count > 0:
+        messages.append(current)
+    return messages
+
+def split_rows_by_size(address, row_tags, row_payload, max_packet_size=MTU_MAX_PACKET_SIZE):
+    """
+    Splits a message whose arguments are rows (each sent as an OSC array) into chunks
+    that each fit under max_packet_size.
+
+    Chunk ends are found with a binary search over the running size of the rows, so
+    the cost is one searchsorted per chunk rather than a Python loop per row. Type tag
+    padding is bounded by 3 bytes, which keeps every chunk conservatively under budget.
+
+    :param address: OSC address of every chunk.
+    :param row_tags: Array with the number of type tag characters of each row.
+    :param row_payload: Array with the number of payload bytes of each row.
+    :param max_packet_size: Maximum encoded size of a single message in bytes.
+    :return: Array of chunk start indices (always starts with 0).
+    """
+    num_rows = len(row_tags)
+    # ',' + null terminator + up to 3 bytes of padding on the type tag string.
+    budget = max_packet_size - osc_string_size(address) - 5
+    running = np.concatenate(([0], np.cumsum(np.asarray(row_tags) + np.asarray(row_payload))))
+    starts = []
+    start = 0
+    while start < num_rows:
+        starts.append(start)
+        end = int(np.searchsorted(running, running[start] + budget, side="right")) - 1
+        start = max(end, start + 1) # always make progress, even if a single row is over budget
+    return np.array(starts, dtype=int)
+
+def chunk_relative_times(times, starts):
+    """
+    Re-offsets onset times so each chunk is relative to the last onset of the chunk
+    before it (the first chunk is left as is), which is how GuitarBot chains chunks.
+    """
+    times = np.asarray(times, dtype=float)
+    lengths = np.diff(np.append(starts, len(times)))
+    prev_last = np.concatenate(([0.0], times[starts[1:] - 1]))
+    return times - np.repeat(prev_last, lengths)
+
+def build_message(address, args):
+    """Builds an OscMessage from an address and a list of arguments."""
+    builder = OscMessageBuilder(address=address)
+    for arg in args:
+        builder.add_arg(arg)
+    return builder.build()
+
+def pack_bundles(messages, timetag, max_packet_size=MTU_MAX_PACKET_SIZE):
+    """
+    Packs (address, args) messages, in order, into as few OSC bundles as fit under
+    max_packet_size. A bundle is the '#bundle' string and an 8 byte timetag followed
+    by a 4 byte size prefix per element. Every bundle carries the same timetag, so a
+    receiver that honours timetags schedules all of them for the same instant.
+
+    :param messages: List of (address, args) tuples.
+    :param timetag: Unix time (seconds) the bundle is meant for; python-osc converts it
+                    to an NTP timetag. Use osc_bundle_builder.IMMEDIATELY for "now".
+    :param max_packet_size: Maximum encoded size of a single bundle in bytes.
+    :return: List of OscBundle objects.
+    """
+    groups = []
+    current, size = [], 16
+    for address, args in messages:
+        element_size = 4 + osc_message_size(address, args)
+        if current and size + element_size > max_packet_size:
+            groups.append(current)
+            current, size = [], 16
+        current.append((address, args))
+        size += element_size
+    if current:
+        groups.append(current)
+
+    bundles = []
+    for group in groups:
+        builder = OscBundleBuilder(timetag)
+        for address, args in group:
+            builder.add_content(build_message(address, args))
+        bundles.append(builder.build())
+    return bundles
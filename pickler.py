@@ -8,15 +8,19 @@ from music21 import stream, note, midi, harmony, converter
 import chords
 from ec2vae_encode import m21_to_one_hot, midi_to_melody_array
 from polydis_encode import midi_to_prmat, midi_to_pianotree, midi_to_chordvec, merge_instruments_to_single_track
+from dedupe import dedupe_pairs, find_near_duplicates
 from tqdm import tqdm
 
-def process_directory_to_ec2vae_pickle(directory, pickle_filename="vae_data.pkl"):
+def process_directory_to_ec2vae_pickle(directory, pickle_filename="vae_data.pkl", dedupe=True, dedupe_threshold=0.8):
     """
     Iterates over the directory, processes each melody and chord file pair,
     and stores the resulting melody and chord arrays in a dictionary.
     
     Keys are derived from the filename suffix (the common part after the prefix).
     Values are dictionaries with keys 'melody' and 'chords'.
+
+    If dedupe is True, near-duplicate pairs (see dedupe.py) are reported and
+    dropped before anything is encoded.
     
     The dictionary is saved to a pickle file.
     """
@@ -33,6 +37,11 @@ def process_directory_to_ec2vae_pickle(directory, pickle_filename="vae_data.pkl"
         suffix = chord_file[len("CHORDS_"):]
         chord_dict[suffix] = chord_file
     
+    if dedupe:
+        paired = [f[len("MELODY_"):] for f in melody_files if f[len("MELODY_"):] in chord_dict]
+        keep = set(dedupe_pairs(directory, paired, threshold=dedupe_threshold))
+        melody_files = [f for f in melody_files if f[len("MELODY_"):] not in chord_dict or f[len("MELODY_"):] in keep]
+
     # Dictionary to hold the processed arrays for each song.
     data_dict = {}
     
@@ -79,7 +88,7 @@ def process_directory_to_ec2vae_pickle(directory, pickle_filename="vae_data.pkl"
     return data_dict
 
 
-def process_directory_to_polydis_pickle(directory, pickle_filename="polydis_data.pkl", ec2_compatible_input=True):
+def process_directory_to_polydis_pickle(directory, pickle_filename="polydis_data.pkl", ec2_compatible_input=True, dedupe=True, dedupe_threshold=0.8):
     """
     Iterates over a directory, processes each MIDI file into PolyDis-compatible
     representations, and saves the results to a pickle file.
@@ -93,12 +102,21 @@ def process_directory_to_polydis_pickle(directory, pickle_filename="polydis_data
         directory (str): Path to the folder containing MIDI files.
         pickle_filename (str): Filename to save the resulting pickle dictionary.
         ec2_compatible_input (bool): If True, processes files with specific chord/melody prefixes.
+        dedupe (bool): If True, near-duplicate songs are reported and dropped before encoding.
+        dedupe_threshold (float): Minimum estimated similarity for two songs to count as duplicates.
     """
     midi_files = [f for f in os.listdir(directory) if f.lower().endswith(".mid") or f.lower().endswith(".midi")]
     
     # Filter files based on prefixes
     data_dict = {}
     if not ec2_compatible_input:
+        if dedupe:
+            keep, duplicates = find_near_duplicates({f: (os.path.join(directory, f), None) for f in midi_files},
+                                                    threshold=dedupe_threshold)
+            for dup, (kept, estimate) in sorted(duplicates.items()):
+                print(f"Near-duplicate ({estimate:.2f}): {dup}  -->  keeping {kept}")
+            print(f"Dedupe: {len(midi_files)} files, {len(duplicates)} near-duplicates dropped.")
+            midi_files = keep
         for midi_file in tqdm(midi_files, desc="Processing MIDI files"):
             midi_path = os.path.join(directory, midi_file)
             try:
@@ -124,9 +142,13 @@ def process_directory_to_polydis_pickle(directory, pickle_filename="polydis_data
     else:
         melody_files = [f for f in midi_files if f.startswith("MELODY_")]
         chord_files = [f for f in midi_files if f.startswith("CHORDS_")]
+        if dedupe:
+            paired = [f[len("MELODY_"):] for f in melody_files if "CHORDS_" + f[len("MELODY_"):] in chord_files]
+            keep = set(dedupe_pairs(directory, paired, threshold=dedupe_threshold))
+            melody_files = [f for f in melody_files if f[len("MELODY_"):] in keep]
         for melody_file in tqdm(melody_files, desc="Processing MIDI files"):
             suffix = melody_file[len("MELODY_"):]
-            if suffix in chord_files:
+            if "CHORDS_" + suffix in chord_files:
                 print(f"Processing pair: {melody_file}  <-->  CHORDS_{suffix}")
                 melody_path = os.path.join(directory, melody_file)
                 chord_path = os.path.join(directory, "CHORDS_" + suffix)
@@ -0,0 +1,284 @@
+# pipeline.py
+"""
+Staged, concurrent version of the live NeuralNote -> GuitarBot path.
+
+midi_to_GB_UDP runs parse, chord analysis, melody, VAE, post-processing and send one
+after another on the watcher thread, so a new take waits for the previous one to be
+completely sent. Here every stage has its own worker thread(s) and the stages are
+joined by bounded queues: while take N is in the VAE or waiting for its beat, take
+N+1 can already be parsed and analysed.
+
+Each take travels through the stages as a dictionary. Every stage stamps
+take["times"][<stage>] when it finishes, and the pipeline keeps per-stage timings
+and queue depths (see stats() / print_stats()).
+
+A newer take from the same source pre-empts older ones (LatestWins): queued takes
+are dropped before their next stage and a take in the VAE stops at the next window
+boundary, so the CPU goes to the take that matters.
+
+Example:
+    pipeline = TakePipeline(ec2_generator, send=send_take).start()
+    watch_directory(NN_dir, pipeline.submit)
+"""
+
+import os
+import queue
+import statistics
+import threading
+import time
+import traceback
+import numpy as np
+from chords import MIDI_Stream
+from ec2vae_encode import m21_to_one_hot
+from melody import rule_based_melody, melody_to_array
+from ec2_gen import GenerationCancelled, check_cancelled
+
+_STOP = object()
+
+class LatestWins:
+    def __init__(self, source_of=os.path.dirname):
+        """
+        Latest-wins policy for in-flight generations: starting a take cancels every
+        unfinished take from the same source.
+
+        Args:
+            source_of: Maps a take's file path to its source. By default the directory
+                       it was written to, so NeuralNote and Anticipation takes don't
+                       pre-empt each other.
+        """
+        self.source_of = source_of
+        self.active = {} # source -> cancel event of the newest take
+        self.stats = {"started": 0, "preempted": 0, "finished": 0}
+        self._lock = threading.Lock()
+
+    def begin(self, path):
+        """Registers a new take and returns its cancel event (a threading.Event)."""
+        source = self.source_of(path)
+        cancel_event = threading.Event()
+        with self._lock:
+            previous = self.active.get(source)
+            if previous is not None and not previous.is_set():
+                previous.set()
+                self.stats["preempted"] += 1
+                print(f"New take from {source or '.'}: cancelling the previous one")
+            self.active[source] = cancel_event
+            self.stats["started"] += 1
+        return cancel_event
+
+    def end(self, path, cancel_event):
+        """Marks a take as done (sent or cancelled)."""
+        source = self.source_of(path)
+        with self._lock:
+            if self.active.get(source) is cancel_event:
+                del self.active[source]
+            self.stats["finished"] += 1
+
+class Stage:
+    def __init__(self, name, func, in_queue, out_queue=None, workers=1, on_cancel=None):
+        """
+        One pipeline stage: workers threads take items from in_queue, apply func and put
+        the result on out_queue. func may return None to drop the take. Takes whose
+        take["cancel"] event is set, or whose func raises, are dropped and passed to
+        on_cancel instead, so their LatestWins entry is released.
+        """
+        self.name = name
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.workers = workers
+        self.durations = []
+        self.max_queue_depth = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.on_cancel = on_cancel
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        while True:
+            take = self.in_queue.get()
+            if take is _STOP:
+                self.in_queue.put(_STOP) # let the other workers of this stage see it too
+                return
+            with self._lock:
+                self.max_queue_depth = max(self.max_queue_depth, self.in_queue.qsize() + 1)
+            t_start = time.time()
+            try:
+                check_cancelled(take.get("cancel"), f"before {self.name}")
+                result = self.func(take)
+            except GenerationCancelled as e:
+                with self._lock:
+                    self.cancelled += 1
+                print(f"{e} for {take.get('file')}")
+                if self.on_cancel is not None:
+                    self.on_cancel(take)
+                continue
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                print(f"Pipeline stage {self.name} failed for {take.get('file')}:")
+                traceback.print_exc()
+                if self.on_cancel is not None:
+                    self.on_cancel(take)
+                continue
+            t_end = time.time()
+            take["times"][self.name] = t_end
+            with self._lock:
+                self.durations.append(t_end - t_start)
+            if result is not None and self.out_queue is not None:
+                self.out_queue.put(result)
+
+    def join(self, timeout=None):
+        for t in self._threads:
+            t.join(timeout)
+
+class TakePipeline:
+    def __init__(self, ec2_generator, send, song_key='Grateful Dead - Uncle Johns Band.mid', get_bpm=None,
+                 window_size=32, queue_size=2, analysis_workers=1, latest_wins=True):
+        """
+        Args:
+            ec2_generator: A loaded EC2Generator. Only the VAE stage touches it.
+            send: Called as send(take) from the single send worker, with take["chords"],
+                  take["strum"], take["pluck_message"] and take["bpm"] filled in.
+            song_key: Reference song for the rhythm latent.
+            get_bpm: Returns the current BPM when a take is submitted (default 100).
+            window_size: EC2VAE window length in sixteenths.
+            queue_size: Capacity of each queue between stages. When the first queue is full,
+                        submit() blocks the watcher (backpressure).
+            analysis_workers: Workers for the parse, chord and melody stages. With more than one,
+                              a short take can overtake a long one before the VAE. The VAE,
+                              post-process and send stages always have one worker each.
+            latest_wins: Cancel unfinished takes from the same source when a new one is submitted.
+        """
+        self.ec2_generator = ec2_generator
+        self.send = send
+        self.song_key, _, _, self.song_data = ec2_generator.song_select(song_key)
+        self.get_bpm = get_bpm or (lambda: 100)
+        self.window_size = window_size
+        self.completed = []
+        self.latest = LatestWins() if latest_wins else None
+        self._take_index = 0
+
+        names = ["parse", "chords", "melody", "vae", "postprocess", "send"]
+        funcs = [self.parse, self.analyse_chords, self.make_melody, self.run_vae, self.postprocess, self.send_take]
+        workers = [analysis_workers] * 3 + [1, 1, 1]
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in names]
+        self.stages = []
+        for i, name in enumerate(names):
+            out_queue = self.queues[i + 1] if i + 1 < len(names) else None
+            self.stages.append(Stage(name, funcs[i], self.queues[i], out_queue, workers[i], on_cancel=self._finish))
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Lets every take already submitted finish, then stops the workers."""
+        for q, stage in zip(self.queues, self.stages):
+            q.put(_STOP)
+            stage.join(timeout)
+
+    def submit(self, midi_file_path):
+        """Queues a new take. Blocks while the parse queue is full."""
+        take = {"index": self._take_index, "file": midi_file_path, "bpm": self.get_bpm(),
+                "times": {"submitted": time.time()}}
+        if self.latest is not None:
+            take["cancel"] = self.latest.begin(midi_file_path)
+        self._take_index += 1
+        self.queues[0].put(take)
+        return take
+
+    # Stages
+
+    def parse(self, take):
+        take["midi_stream"] = MIDI_Stream(take["file"], bpm=take["bpm"]) # same grid as the melody and plucks
+        return take
+
+    def analyse_chords(self, take):
+        ms = take["midi_stream"]
+        take["chords"], take["strum"], _, _ = ms.get_UDP_lists()
+        take["full_chords"] = ms.get_full_chord_list()
+        take["in_car"] = m21_to_one_hot(take["full_chords"])
+        cache = self.ec2_generator.cache
+        if cache is not None:
+            take["cache_key"], take["shift"] = cache.key_for(take["in_car"], self.song_key, self.window_size, 0, None, take["bpm"])
+            cached = cache.get_generation(take["cache_key"], take["shift"])
+            if cached is not None:
+                # Repeated progression (in any key): melody and VAE pass it straight through
+                take["prediction"], take["rbm"] = cached
+                take["cached"] = True
+        return take
+
+    def make_melody(self, take):
+        if "prediction" in take:
+            return take
+        # Kept in memory: several workers writing rule_based_melody.mid at once would race
+        rbm, _ = rule_based_melody(take["full_chords"], bpm=take["bpm"], debug=False, write_midi=False)
+        take["rbm"] = rbm
+        in_mar = melody_to_array(rbm, bpm=take["bpm"]) if rbm else np.full(take["in_car"].shape[0], 129, dtype=int)
+        take["windows"] = self.ec2_generator.prepare_windows(in_mar, take["in_car"], self.song_data["melody"],
+                                                            self.song_data["chords"], self.window_size)
+        return take
+
+    def run_vae(self, take):
+        if "prediction" in take:
+            return take
+        in_mar, in_car, melody_array, chord_array, total_length = take["windows"]
+        predictions = []
+        for i, window in enumerate(self.ec2_generator.iterate_windows(in_mar, in_car, melody_array, chord_array, self.window_size)):
+            check_cancelled(take.get("cancel"), f"before window {i + 1}")
+            predictions.append(self.ec2_generator.decode_window(*window))
+        take["prediction"] = np.concatenate(predictions)
+        return take
+
+    def postprocess(self, take):
+        take["pluck_message"] = self.ec2_generator.prediction_to_guitarbot(take["prediction"], bpm=take["bpm"],
+                                                                           default_speed=7, rbm=take["rbm"])
+        if "cache_key" in take and "cached" not in take:
+            self.ec2_generator.cache.put_generation(take["cache_key"], take["shift"], take["prediction"], take["rbm"])
+        return take
+
+    def send_take(self, take):
+        self.send(take)
+        take["times"]["sent"] = time.time()
+        self.completed.append(take)
+        self._finish(take)
+        print(f"Take {take['index']} done in {take['times']['sent'] - take['times']['submitted']:.3f}s")
+        return None
+
+    def _finish(self, take):
+        if self.latest is not None and "cancel" in take:
+            self.latest.end(take["file"], take["cancel"])
+
+    # Stats
+
+    def stats(self):
+        """Per-stage timings (seconds) and current/maximum input queue depths."""
+        result = {}
+        for stage in self.stages:
+            durations = list(stage.durations)
+            result[stage.name] = {
+                "count": len(durations),
+                "mean": statistics.mean(durations) if durations else 0.0,
+                "max": max(durations) if durations else 0.0,
+                "queue_depth": stage.in_queue.qsize(),
+                "max_queue_depth": stage.max_queue_depth,
+                "errors": stage.errors,
+                "cancelled": stage.cancelled,
+            }
+        return result
+
+    def print_stats(self):
+        print(f"{'stage':<12} {'count':>5} {'mean ms':>9} {'max ms':>9} {'queue':>6} {'max q':>6} {'cancel':>6}")
+        for name, s in self.stats().items():
+            print(f"{name:<12} {s['count']:>5} {s['mean'] * 1000:>9.1f} {s['max'] * 1000:>9.1f} "
+                  f"{s['queue_depth']:>6} {s['max_queue_depth']:>6} {s['cancelled']:>6}")
+        if self.latest is not None:
+            print(f"Takes started: {self.latest.stats['started']}, pre-empted: {self.latest.stats['preempted']}")
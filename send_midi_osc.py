@@ -1,17 +1,20 @@
 import mido
+from osc_transport import ABLETON_IP, ABLETON_PORT, get_transport
 
 def send_midi(client, file_path, bpm=120, timesig=[4, 4], fire_immediately=False, time_offset=0, track_index=0, clip_index=0, file_idx=0):
     """
     Sends the MIDI note events in file_path to Ableton via OSC.
     If a time_offset (in beats) is provided, it will be added to each note event's start time.
 
-    :param client: OSC client.
+    :param client: OSC client, or None for a client for Live on the shared OSC transport.
     :param file_path: Path to the MIDI file.
     :param bpm: Beats per minute.
     :param timesig: Time signature as [beats_per_bar, note_value].
     :param fire_immediately: If True, the clip is fired immediately.
     :param time_offset: Offset (in beats) added to all note events.
     """
+    if client is None:
+        client = get_transport().client(ABLETON_IP, ABLETON_PORT)
     try:
         midi_file = mido.MidiFile(file_path)
         # Calculate clip length in beats using MIDI file length
@@ -0,0 +1,118 @@
+# speculative.py
+"""
+Speculative sampling for the anticipatory music transformer.
+
+The small model (draft) proposes up to num_draft tokens one at a time; the large model
+(target) scores all of them in one forward pass. Each proposed token is kept with
+probability min(1, p/q) (p: target, q: draft, both after anticipation's logit filters);
+the first rejected one is replaced by a sample from the normalized max(0, p - q), and if
+all are kept the target's next token comes for free. The output follows the target's
+distribution exactly, while the target runs once per accepted block instead of once
+per token. Both models keep their key/value caches like ContinuationSession.
+
+Drafting stops after an event at or past the stop time (end of the span, or where the
+next anticipated control is inserted), so no token is ever proposed in a context that
+generation would change.
+
+Example:
+    session = SpeculativeSession(registry.get('large'), registry.get('small'))
+    midi = session.continuation("take.mid", 16)
+    inpainted, combined = session.inpaint("take.mid", 4, 8)
+    print(session.acceptance_rate())
+"""
+
+import torch
+from anticipation.vocab import TIME_OFFSET
+from anti import ContinuationSession
+
+class SpeculativeSession(ContinuationSession):
+    def __init__(self, model, draft_model, num_draft=4, top_p=.95, context=None):
+        """
+        Args:
+            model: Target model (e.g. the large anticipation model); its distribution is kept.
+            draft_model: Draft model sharing the target's vocabulary (e.g. the small model).
+            num_draft: Tokens proposed per target forward pass.
+            top_p: Nucleus sampling threshold, as in anti.inpaint/continuation.
+            context: History tokens the models see. Defaults to leave room for the draft
+                     tokens within the 1024 positions of the models.
+        """
+        if context is None:
+            context = 1017 - 2 * num_draft
+        super().__init__(model, top_p=top_p, context=context)
+        self.draft = ContinuationSession(draft_model, top_p=top_p, context=context)
+        self.num_draft = num_draft
+        self.stats.update({"drafted": 0, "accepted": 0, "blocks": 0})
+
+    def reset(self):
+        super().reset()
+        self.partial = [] # accepted tokens of an event not yet complete
+
+    def acceptance_rate(self):
+        return self.stats["accepted"] / self.stats["drafted"] if self.stats["drafted"] else 0.
+
+    def generate(self, *args, **kwargs):
+        self.partial = []
+        return super().generate(*args, **kwargs)
+
+    def next_events(self, z, tokens, current_time, stop_time):
+        while len(self.partial) < 3:
+            self.partial += self._speculate(z, tokens, current_time, stop_time)
+        complete = len(self.partial) // 3 * 3
+        events = [self.partial[i:i+3] for i in range(0, complete, 3)]
+        self.partial = self.partial[complete:]
+        return events
+
+    def _speculate(self, z, tokens, current_time, stop_time):
+        """One draft/verify block. Returns the accepted tokens (absolute times)."""
+        history, offset = self._window(tokens)
+        base = z + history
+        seq = list(self.partial) # relative times from here on, like history
+        seq[::3] = [tok - offset for tok in seq[::3]]
+        start = len(seq)
+
+        def event_time(i):
+            return seq[i - (i % 3)] - TIME_OFFSET + offset
+
+        # context of the token at each position: (idx, i, current time, full tokens)
+        def context_at(pos):
+            last_event = pos - (pos % 3) - 3
+            now = current_time if last_event < 0 else max(current_time, event_time(last_event))
+            return len(base) + pos - 1, pos % 3, now - offset, tokens + seq[:pos]
+
+        drafted = []
+        stopped = False
+        with torch.no_grad():
+            for _ in range(self.num_draft):
+                ctx = context_at(len(seq))
+                q = self.draft._probs(self.draft._next_logits(base + seq), *ctx)
+                seq.append(int(torch.multinomial(q, 1)))
+                drafted.append((q, ctx))
+                if len(seq) % 3 == 0 and event_time(len(seq) - 3) >= stop_time:
+                    stopped = True # generation looks at this event before going on
+                    break
+
+            target_logits = self._block_logits(base + seq, len(drafted) + 1)
+            accepted = []
+            kept = 0
+            for j, (q, ctx) in enumerate(drafted):
+                p = self._probs(target_logits[j], *ctx)
+                token = seq[start + j]
+                if torch.rand(()) * q[token] < p[token]:
+                    accepted.append(token)
+                    kept += 1
+                    continue
+                residual = torch.clamp(p - q, min=0)
+                if residual.sum() <= 0:
+                    residual = p
+                accepted.append(int(torch.multinomial(residual / residual.sum(), 1)))
+                break
+            else:
+                if not stopped:
+                    p = self._probs(target_logits[-1], *context_at(len(seq)))
+                    accepted.append(int(torch.multinomial(p, 1)))
+
+        self.stats["drafted"] += len(drafted)
+        self.stats["accepted"] += kept
+        self.stats["blocks"] += 1
+        # back to absolute times for the time tokens
+        return [tok + offset if (start + k) % 3 == 0 else tok for k, tok in enumerate(accepted)]
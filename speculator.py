@@ -0,0 +1,151 @@
+# speculator.py
+"""
+Idle-time speculative pre-generation.
+
+Between takes the main loop just sleeps. The Speculator uses that time to generate
+the phrases the next take is most likely to need, based on the progression that
+was just played, started from each later bar, as happens when a loop is picked up
+mid-way. Candidates always use the live path's reference song, since that is the
+only key a real take claims with.
+
+Results go into a bounded pool (a GenerationCache, so keys are transposition
+invariant like the main cache). On a cache miss, EC2Generator.generate_prediction_for_one_song
+claims a matching phrase from the pool instantly. As soon as a real file arrives,
+preempt() cancels the speculative generation at its next window boundary, and no new
+speculative work starts until the real take is done (release()) and the process has
+been idle for idle_delay seconds.
+
+Example:
+    speculator = Speculator(ec2_generator, song_key).start()
+    speculator.preempt()           # a real take arrived
+    ...generate and send...
+    speculator.observe(full_chords, bpm)
+    speculator.release()
+"""
+
+import threading
+import time
+from collections import deque
+from ec2vae_encode import m21_to_one_hot
+from ec2_gen import GenerationCancelled
+from generation_cache import GenerationCache
+
+class Speculator:
+    def __init__(self, ec2_generator, song_key, pool_size=16, beats_per_bar=4, max_rotations=3, window_size=32, idle_delay=0.5):
+        """
+        Args:
+            ec2_generator: The EC2Generator shared with the live path. Must have a cache.
+            song_key: Reference song used by the live path.
+            pool_size: Maximum number of speculative generations kept.
+            beats_per_bar: Beats per bar of the full chord list (one entry per beat).
+            max_rotations: Number of later starting bars to try.
+            window_size: EC2VAE window length in sixteenths.
+            idle_delay: Seconds without real work before speculation starts.
+        """
+        if ec2_generator.cache is None:
+            raise ValueError("Speculator needs an EC2Generator with a GenerationCache")
+        self.ec2_generator = ec2_generator
+        self.song_key = song_key
+        self.beats_per_bar = beats_per_bar
+        self.max_rotations = max_rotations
+        self.window_size = window_size
+        self.idle_delay = idle_delay
+
+        self.pool = GenerationCache(max_entries=pool_size, transpose_invariant=ec2_generator.cache.transpose_invariant)
+        self.stats = {"generated": 0, "preempted": 0, "claimed": 0, "skipped": 0}
+        self.candidates = deque()
+        self._busy = 0 # real takes in flight
+        self._last_activity = time.time()
+        self._cancel_event = threading.Event()
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        ec2_generator.speculator = self
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._cancel_event.set()
+            self._wakeup.notify_all()
+        self._thread.join()
+
+    # Called from the live path
+
+    def preempt(self):
+        """A real take arrived: cancel speculative work and hold off until release()."""
+        with self._wakeup:
+            self._busy += 1
+            self._last_activity = time.time()
+            self._cancel_event.set()
+
+    def release(self):
+        """The real take is done; speculation may resume after idle_delay."""
+        with self._wakeup:
+            self._busy = max(0, self._busy - 1)
+            self._last_activity = time.time()
+            self._wakeup.notify_all()
+
+    def observe(self, full_chords, bpm=100):
+        """Replaces the queued candidates with the likely successors of this progression."""
+        candidates = []
+        bar_beats = self.beats_per_bar
+        num_bars = len(full_chords) // bar_beats
+        for bar in range(1, min(num_bars, self.max_rotations + 1)):
+            rotated = full_chords[bar * bar_beats:] + full_chords[:bar * bar_beats]
+            candidates.append((self.song_key, rotated, bpm))
+        with self._wakeup:
+            self.candidates = deque(candidates)
+            self._wakeup.notify_all()
+
+    def claim(self, key, shift):
+        """Takes a pre-generated (prediction, rbm) out of the pool, shifted into the played key."""
+        if not self.pool.contains(key):
+            return None
+        claimed = self.pool.get_generation(key, shift)
+        self.pool.pop(key)
+        if claimed is not None:
+            self.stats["claimed"] += 1
+            print("Claimed a speculative generation")
+        return claimed
+
+    # Worker
+
+    def _next_candidate(self):
+        """Blocks until there is a candidate and the live path has been idle long enough."""
+        with self._wakeup:
+            while not self._stopped:
+                idle_for = time.time() - self._last_activity
+                if self._busy == 0 and self.candidates and idle_for >= self.idle_delay:
+                    self._cancel_event.clear()
+                    return self.candidates.popleft()
+                timeout = max(self.idle_delay - idle_for, 0.05) if self.candidates and self._busy == 0 else None
+                self._wakeup.wait(timeout)
+        return None
+
+    def _run(self):
+        while True:
+            candidate = self._next_candidate()
+            if candidate is None:
+                return
+            reference_key, full_chords, bpm = candidate
+            key, shift = self.pool.key_for(m21_to_one_hot(full_chords), reference_key, self.window_size, 0, None, bpm)
+            if self.pool.contains(key) or self.ec2_generator.cache.contains(key):
+                self.stats["skipped"] += 1
+                continue
+            song_data = self.ec2_generator.data_dict[reference_key]
+            try:
+                # write_midi=False: a real take may be writing rule_based_melody.mid right now
+                prepared = self.ec2_generator.prepare_song_input(reference_key, song_data, self.window_size, bpm=bpm,
+                                                                 full_chords=full_chords, write_midi=False)
+                prediction = self.ec2_generator.decode_prepared(prepared, self.window_size, cancel_event=self._cancel_event)
+            except GenerationCancelled:
+                self.stats["preempted"] += 1
+                with self._wakeup:
+                    self.candidates.appendleft(candidate) # try again at the next idle moment
+                continue
+            self.pool.put_generation(key, shift, prediction, prepared[0])
+            self.stats["generated"] += 1
@@ -0,0 +1,189 @@
+# streaming.py
+"""
+Incremental, window-by-window EC2 generation for a take that is still coming in
+(experimental).
+
+Notes are fed to a StreamingEC2Session as they appear. As soon as a full 2-bar window
+(32 sixteenths) of input exists, the session runs chord analysis, the rule-based
+melody and the EC2 encode/decode for just that window and hands its /Pluck chunks
+(the same rows iter_pluck_chunks sends) to a callback.
+
+The only note feed here is follow_midi_file, which polls a MIDI file. NeuralNote only
+writes finished files, so with NeuralNote this does not start before the take is
+over: it decodes and sends window by window like progressive_mode, and then waits
+idle_timeout before the last window. It only generates during the take for a writer
+that saves partial files, or for a source that calls set_notes/advance directly.
+"""
+
+import os
+import time
+import numpy as np
+import pretty_midi
+import chords
+from ec2vae_encode import m21_to_one_hot
+from melody import rule_based_melody, melody_to_array
+
+def fit_length(array, length):
+    """Truncates or zero-pads array along its first axis to length rows."""
+    if array.shape[0] >= length:
+        return array[:length]
+    padding = np.zeros((length - array.shape[0],) + array.shape[1:], dtype=array.dtype)
+    return np.concatenate((array, padding))
+
+class StreamingEC2Session:
+    def __init__(self, ec2_generator, song_data, bpm=100, timesig=[4, 4], window_size=32, default_speed=7, on_window=None):
+        """
+        Initialize a streaming session for one take.
+
+        Args:
+            ec2_generator: A loaded EC2Generator.
+            song_data: Reference song entry from the data dictionary ("melody"/"chords").
+            bpm: Tempo of the incoming take.
+            timesig: Time signature as [beats_per_bar, note_value].
+            window_size: Window length in sixteenths (32 = 2 bars of 4/4).
+            default_speed: Pluck speed used when no rule-based speed applies.
+            on_window: Called as on_window(window_index, prediction_window, chunks) as soon as
+                       each window is decoded. chunks are the window's /Pluck chunks from
+                       EC2Generator.window_pluck_chunks (count-in, metronome and speed
+                       normalization included, ontimes chained onto the previous window).
+        """
+        self.ec2_generator = ec2_generator
+        self.bpm = bpm
+        self.timesig = timesig
+        self.window_size = window_size
+        self.default_speed = default_speed
+        self.on_window = on_window
+
+        self.window_beats = window_size // 4
+        self.window_seconds = self.window_beats * 60 / bpm
+        self.reference_melody = song_data["melody"]
+        self.reference_chords = song_data["chords"]
+
+        self.notes = [] # {"pitch", "onset", "offset"} in seconds from the start of the take
+        self.input_time = 0.0 # input is complete up to here
+        self.next_window = 0
+        self.last_ontime = 0.0 # absolute ontime of the last row sent, for chaining
+        self.predictions = []
+        self.window_times = [] # seconds spent decoding each window
+
+    def add_note(self, pitch, onset, offset):
+        self.notes.append({"pitch": pitch, "onset": onset, "offset": offset})
+
+    def add_notes(self, notes):
+        for n in notes:
+            self.add_note(n["pitch"], n["onset"], n["offset"])
+
+    def set_notes(self, notes):
+        """Replaces every note, e.g. after a rewrite changed some offsets. Decoded windows are kept."""
+        self.notes = [{"pitch": n["pitch"], "onset": n["onset"], "offset": n["offset"]} for n in notes]
+
+    def advance(self, input_time):
+        """
+        Marks the input as complete up to input_time (seconds) and processes every
+        window that is now fully available. Returns the number of windows processed.
+        """
+        self.input_time = max(self.input_time, input_time)
+        processed = 0
+        while (self.next_window + 1) * self.window_seconds <= self.input_time:
+            self._process_window(self.next_window)
+            self.next_window += 1
+            processed += 1
+        return processed
+
+    def finish(self):
+        """Processes the last, possibly partial, window once the take has ended."""
+        if any(n["onset"] >= self.next_window * self.window_seconds for n in self.notes):
+            self._process_window(self.next_window)
+            self.next_window += 1
+        return self.prediction()
+
+    def prediction(self):
+        """The concatenated prediction of every window decoded so far."""
+        if not self.predictions:
+            return None
+        return np.concatenate(self.predictions)
+
+    def window_notes(self, index):
+        """
+        Notes of window index, relative to the window start. Notes still sounding from
+        the previous window are carried in so held chords keep being recognized.
+        """
+        start = index * self.window_seconds
+        end = start + self.window_seconds
+        notes = []
+        for n in self.notes:
+            if start <= n["onset"] < end:
+                notes.append({"pitch": n["pitch"], "onset": n["onset"] - start, "offset": n["offset"] - start})
+            elif n["onset"] < start < n["offset"]:
+                notes.append({"pitch": n["pitch"], "onset": 0.0, "offset": n["offset"] - start})
+        return notes
+
+    def _process_window(self, index):
+        t_start = time.time()
+        window_size = self.window_size
+
+        # Chord analysis over this window only. A hair of extra duration keeps the
+        # beat count from rounding down to window_beats - 1.
+        ms = chords.MIDI_Stream.from_notes(self.window_notes(index), self.window_seconds + 1e-6, self.bpm, self.timesig)
+        full_chords = ms.get_full_chord_list()
+        rbm, _ = rule_based_melody(full_chords, bpm=self.bpm, debug=False, write_midi=False)
+
+        in_mar = fit_length(melody_to_array(rbm, bpm=self.bpm), window_size) if rbm else np.full(window_size, 129, dtype=int)
+        in_car = fit_length(m21_to_one_hot(full_chords), window_size)
+        ref_start = index * window_size
+        mel_window = fit_length(self.reference_melody[ref_start:ref_start + window_size], window_size)
+        ch_window = fit_length(self.reference_chords[ref_start:ref_start + window_size], window_size)
+
+        prediction_window = self.ec2_generator.decode_window(in_mar, in_car, mel_window, ch_window)
+        self.predictions.append(prediction_window)
+        chunks, self.last_ontime = self.ec2_generator.window_pluck_chunks(
+            prediction_window, index, rbm, window_size, self.bpm, self.default_speed, last_ontime=self.last_ontime)
+        self.window_times.append(time.time() - t_start)
+        print(f"Window {index + 1}: {sum(len(c) for c in chunks)} /Pluck rows decoded in {self.window_times[-1]:.3f}s")
+        if self.on_window is not None:
+            self.on_window(index, prediction_window, chunks)
+
+def read_notes(midi_file_path):
+    """Reads every non-drum note of a (possibly still growing) MIDI file. Returns None if unreadable."""
+    try:
+        midi = pretty_midi.PrettyMIDI(midi_file_path)
+    except Exception:
+        return None
+    notes = []
+    for instrument in midi.instruments:
+        if instrument.is_drum:
+            continue
+        for note in instrument.notes:
+            notes.append({"pitch": note.pitch, "onset": note.start, "offset": note.end})
+    notes.sort(key=lambda n: n["onset"])
+    return notes
+
+def follow_midi_file(midi_file_path, session, poll_interval=0.05, idle_timeout=1.0):
+    """
+    Follows a MIDI file that is still being written, feeding new notes to the session.
+
+    Each time the file changes, the session's notes are replaced by the file's (so a
+    rewrite that changes an offset is picked up) and the input is marked complete up to
+    the last onset (later notes could still arrive before it). Once the file has not
+    changed for idle_timeout seconds the take is considered over and the last partial
+    window is processed.
+    """
+    last_mtime = None
+    last_change = time.time()
+    while True:
+        try:
+            mtime = os.path.getmtime(midi_file_path)
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != last_mtime:
+            notes = read_notes(midi_file_path)
+            if notes is not None:
+                last_mtime = mtime
+                last_change = time.time()
+                session.set_notes(notes)
+                if notes:
+                    session.advance(notes[-1]["onset"])
+        elif time.time() - last_change > idle_timeout:
+            break
+        time.sleep(poll_interval)
+    return session.finish()